@@ -0,0 +1,319 @@
+"""股指期货对冲回测：按与 generate_table 相同的手数与保证金规则，回测一段多头持仓的空头对冲效果。
+
+输入数据（.parquet 或 .csv，日线或分钟线均可）：
+
+    期货行情  时间, 合约代码, 收盘价[, 到期日]     到期日缺省时按中金所规则取合约月份的第三个周五
+    指数行情  时间, 品种, 收盘价                   品种为 IM / IC（对应中证1000 / 中证500 指数）
+    多头持仓  时间, 多头持仓（元）                 可选，缺省为固定金额 --long-money
+
+    python backtest.py run --futures F --index I --product IM --rank 1 --roll-days 3
+    python backtest.py sweep --futures F --index I --workers 4       # 参数网格，多进程
+    python backtest.py run --synthetic-years 3                       # 没有数据时使用合成行情
+"""
+import argparse
+import itertools
+import pathlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import hedging_core as core
+
+FEE_RATE = 0.000023  # 股指期货开平仓手续费率（按成交金额）
+SLIPPAGE_POINTS = 0.2  # 每手每边的滑点（点），即一个最小变动价位
+MINUTE_BARS = np.r_[np.arange(9 * 60 + 31, 11 * 60 + 31), np.arange(13 * 60 + 1, 15 * 60 + 1)]  # 分钟线的收盘时刻
+
+
+def read_table(path):
+    """读取 Parquet（.parquet）或 CSV 文件"""
+    path = pathlib.Path(path)
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path)
+    return pd.read_csv(path, encoding="utf-8-sig")
+
+
+def contract_expiry(codes):
+    """按中金所规则推算股指期货到期日：合约月份的第三个周五（不考虑节假日顺延）"""
+    months = pd.to_datetime("20" + pd.Series(codes).str[-4:], format="%Y%m")
+    first_friday = months + pd.to_timedelta((4 - months.dt.weekday) % 7, unit="D")
+    return (first_friday + pd.Timedelta(days=14)).to_numpy()
+
+
+class BacktestData:
+    """单个品种的回测输入：按时间对齐的合约价格矩阵（行为时间、列为按到期日排序的合约）、指数与多头持仓序列"""
+
+    def __init__(self, futures_df, index_df, product, long_df=None, long_money=1e8):
+        futures_df = futures_df[futures_df["合约代码"].str.fullmatch(rf"{product}\d{{4}}")]
+        index_df = index_df[index_df["品种"] == product]
+        prices = futures_df.pivot_table(index=pd.to_datetime(futures_df["时间"]), columns="合约代码", values="收盘价")
+        index_level = index_df.set_index(pd.to_datetime(index_df["时间"]))["收盘价"].sort_index()
+        times = prices.index.intersection(index_level.index)
+        if "到期日" in futures_df.columns:
+            expiry = pd.to_datetime(futures_df.groupby("合约代码")["到期日"].first().reindex(prices.columns)).to_numpy()
+        else:
+            expiry = contract_expiry(prices.columns)
+        order = np.argsort(expiry, kind="stable")
+
+        self.product = product
+        self.multiplier = core.INDEX_FUTURES_SPECS[product]["合约乘数"]
+        self.margin_rate = core.INDEX_FUTURES_SPECS[product]["做多保证金率"]
+        self.times = times.to_numpy()
+        self.codes = prices.columns.to_numpy()[order]
+        self.expiry = expiry[order]
+        self.prices = prices.loc[times].to_numpy(dtype="float64")[:, order]
+        self.index_level = index_level.loc[times].to_numpy(dtype="float64")
+        if long_df is None:
+            self.long_money = np.full(len(times), float(long_money))
+        else:
+            long_series = long_df.set_index(pd.to_datetime(long_df["时间"]))["多头持仓（元）"].sort_index()
+            self.long_money = long_series.reindex(times, method="ffill").bfill().to_numpy(dtype="float64")
+        # 交易日历：每根 K 线所属交易日、每个交易日的首/末根 K 线
+        self.days = times.normalize().to_numpy()
+        self.trading_days, self.day_start = np.unique(self.days, return_index=True)
+        self.day_end = np.r_[self.day_start[1:], len(times)] - 1
+
+
+def select_contracts(data, rank=1, roll_days=3):
+    """每根 K 线持有的合约列号（无可用合约时为 -1）：在距到期超过 roll_days 个交易日、且有价格的合约中，
+    取到期日第 rank 近的合约（0 为最近月）"""
+    # 合约到期日所在交易日往前数 roll_days 个交易日的第一根 K 线起换月
+    expiry_day = np.searchsorted(data.trading_days, data.expiry, side="right") - 1
+    roll_day = np.clip(expiry_day - roll_days, 0, len(data.trading_days) - 1)
+    roll_bar = np.where(expiry_day - roll_days >= 0, data.day_start[roll_day], 0)
+    roll_bar = np.where(data.expiry > data.trading_days[-1], len(data.times), roll_bar)  # 回测区间内不到期
+    eligible = (np.arange(len(data.times))[:, None] < roll_bar[None, :]) & ~np.isnan(data.prices)
+    ordinal = np.cumsum(eligible, axis=1)
+    target = eligible & (ordinal == rank + 1)
+    return np.where(target.any(axis=1), target.argmax(axis=1), -1)
+
+
+def apply_margin_calls(equity, margin, target_equity, check):
+    """日终权益低于保证金时追加至所需总权益；返回每根 K 线的追加金额。只按追保次数循环，其余均为向量运算"""
+    deposits = np.zeros(len(equity))
+    added = 0.0
+    start = 0
+    while True:
+        shortfall = check[start:] & (equity[start:] + added < margin[start:])
+        if not shortfall.any():
+            return deposits
+        i = start + int(shortfall.argmax())
+        deposits[i] = target_equity[i] - (equity[i] + added)
+        added += deposits[i]
+        start = i + 1
+
+
+def run_backtest(data, rank=1, roll_days=3, hedge_ratio=1.0, rebalance="roll", fee_rate=FEE_RATE,
+                 slippage=SLIPPAGE_POINTS):
+    """回测一组参数，返回 (逐 K 线明细 DataFrame, 汇总 dict)。
+    rebalance 为 "roll" 时只在开仓与换月时按当时价格重算手数，为 "daily" 时每个交易日第一根 K 线也重算"""
+    n_bars = len(data.times)
+    bars = np.arange(n_bars)
+    held = select_contracts(data, rank, roll_days)
+    valid = held >= 0
+    column = np.where(valid, held, 0)
+    prev_held = np.r_[-1, held[:-1]]
+    prev_valid = prev_held >= 0
+    prev_column = np.where(prev_valid, prev_held, 0)
+
+    price = np.where(valid, data.prices[bars, column], np.nan)
+    # 上一根 K 线所持合约在当前与上一根 K 线的价格（换月当根按旧合约结算盈亏后再换仓）
+    old_price_now = np.where(prev_valid, data.prices[bars, prev_column], np.nan)
+    old_price_before = np.r_[np.nan, price[:-1]]
+
+    lot_value = np.floor(np.nan_to_num(price) * data.multiplier).astype("int64")
+    switched = held != prev_held
+    resize = valid & (switched | (rebalance == "daily") & np.isin(bars, data.day_start))
+    sized = core.hedge_arrays(hedge_ratio * data.long_money, np.where(lot_value > 0, lot_value, 1), data.margin_rate)
+    lots = pd.Series(np.where(resize, sized["需做空（手）"], np.nan)).ffill().fillna(0).to_numpy()
+    lots = np.where(valid, lots, 0).astype("int64")
+    prev_lots = np.r_[0, lots[:-1]]
+
+    # 空头期货盈亏、其中的基差部分，以及多头（按指数涨跌）盈亏
+    futures_pnl = np.nan_to_num(-prev_lots * data.multiplier * (old_price_now - old_price_before))
+    index_before = np.r_[data.index_level[0], data.index_level[:-1]]
+    basis_now = old_price_now - data.index_level
+    basis_before = old_price_before - index_before
+    basis_pnl = np.nan_to_num(-prev_lots * data.multiplier * (basis_now - basis_before))
+    long_before = np.r_[data.long_money[0], data.long_money[:-1]]
+    long_pnl = long_before * (data.index_level / index_before - 1)
+
+    # 交易成本：换月时平旧开新，其余时间只交易手数差
+    traded_lots = np.where(switched, prev_lots + lots, np.abs(lots - prev_lots))
+    traded_value = np.where(switched, prev_lots * np.nan_to_num(old_price_now) + lots * np.nan_to_num(price),
+                            np.abs(lots - prev_lots) * np.nan_to_num(price)) * data.multiplier
+    cost = traded_value * fee_rate + traded_lots * slippage * data.multiplier
+    rolled = switched & valid & prev_valid
+    roll_spread = np.where(rolled, price - old_price_now, np.nan)
+
+    # 对冲账户：以首次开仓时的所需总权益入金，日终权益不足保证金时追加至所需总权益
+    margin = np.floor(lots * lot_value * data.margin_rate)
+    target_equity = np.floor(margin + data.long_money * core.EQUITY_BUFFER_RATE)
+    first = int(valid.argmax()) if valid.any() else n_bars
+    initial_equity = target_equity[first] if first < n_bars else 0.0
+    equity = initial_equity + np.cumsum(futures_pnl - cost)
+    check = np.zeros(n_bars, dtype=bool)
+    check[data.day_end] = True
+    check &= lots > 0
+    deposits = apply_margin_calls(equity, margin, target_equity, check)
+    equity = equity + np.cumsum(deposits)
+
+    hedged_pnl = long_pnl + futures_pnl - cost
+    bars_df = pd.DataFrame({
+        "时间": data.times,
+        "持有合约": np.where(valid, data.codes[column], None),
+        "持有空单（手）": lots,
+        "多头损益": long_pnl,
+        "期货损益": futures_pnl,
+        "基差损益": basis_pnl,
+        "交易成本": cost,
+        "对冲后损益": hedged_pnl,
+        "对冲账户所需保证金": margin,
+        "对冲账户权益": equity,
+        "追加保证金": deposits,
+    })
+    daily_pnl = np.add.reduceat(hedged_pnl, data.day_start)
+    cumulative = np.cumsum(daily_pnl)
+    summary = {
+        "品种": data.product,
+        "合约序号": rank,
+        "换月提前天数": roll_days,
+        "对冲比例": hedge_ratio,
+        "调仓方式": rebalance,
+        "多头损益": float(long_pnl.sum()),
+        "期货损益": float(futures_pnl.sum()),
+        "对冲后损益": float(hedged_pnl.sum()),
+        "基差成本": float(-basis_pnl.sum()),
+        "交易成本": float(cost.sum()),
+        "换月次数": int(rolled.sum()),
+        "换月成本": float(cost[rolled].sum()),
+        "平均换月价差（点）": float(np.nanmean(roll_spread)) if rolled.any() else 0.0,
+        "追保次数": int((deposits > 0).sum()),
+        "追保总额": float(deposits.sum()),
+        "对冲后日波动率（年化）": float(np.std(daily_pnl / data.long_money[data.day_start]) * np.sqrt(250)),
+        "对冲后最大回撤": float((np.maximum.accumulate(np.r_[0.0, cumulative]) - np.r_[0.0, cumulative]).max()),
+    }
+    return bars_df, summary
+
+
+def export_result(result, path):
+    """导出回测结果（逐 K 线明细或参数网格汇总），按扩展名选择 Parquet（.parquet）或 CSV 格式；行索引只是序号，不写出"""
+    if str(path).endswith(".parquet"):
+        result.to_parquet(path, index=False)
+    else:
+        result.to_csv(path, index=False, encoding="utf-8-sig")
+    return path
+
+
+_WORKER_DATA = {}
+
+
+def _init_worker(datas):
+    _WORKER_DATA.update(datas)
+
+
+def _run_grid_point(params):
+    product, rank, roll_days, hedge_ratio, rebalance = params
+    return run_backtest(_WORKER_DATA[product], rank, roll_days, hedge_ratio, rebalance)[1]
+
+
+def run_sweep(datas, ranks=(0, 1, 2, 3), roll_days=(1, 3, 5), hedge_ratios=(0.9, 1.0, 1.1), rebalances=("roll",),
+              workers=None):
+    """参数网格回测，datas 为 {品种: BacktestData}；workers > 1 时使用进程池（数据在每个进程初始化时只传一次）"""
+    grid = list(itertools.product(datas, ranks, roll_days, hedge_ratios, rebalances))
+    if workers and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(datas,)) as executor:
+            summaries = list(executor.map(_run_grid_point, grid, chunksize=max(1, len(grid) // (workers * 4))))
+    else:
+        _init_worker(datas)
+        summaries = [_run_grid_point(params) for params in grid]
+    return pd.DataFrame(summaries)
+
+
+def make_synthetic_history(years=3, freq="D", products=("IM", "IC"), annual_discount=0.08, seed=0):
+    """生成合成的指数与期货行情：指数为几何布朗运动，期货贴水按年化 annual_discount 随剩余期限线性收敛。
+    合约挂牌近似中金所规则：非季月合约到期前约 2 个月挂牌，季月合约到期前约 9 个月挂牌"""
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range(end=pd.Timestamp("2024-12-31"), periods=int(years * 250))
+    if freq == "D":
+        times = days + pd.Timedelta(hours=15)
+    else:
+        times = (days.to_numpy()[:, None] + pd.to_timedelta(MINUTE_BARS, unit="min").to_numpy()[None, :]).ravel()
+        times = pd.DatetimeIndex(times)
+    step = 1 / (250 if freq == "D" else 250 * len(MINUTE_BARS))
+    months = pd.period_range(days[0].to_period("M"), (days[-1] + pd.DateOffset(months=10)).to_period("M"), freq="M")
+
+    futures_frames, index_frames = [], []
+    for product, start_level in zip(products, (6000.0, 5500.0)):
+        level = start_level * np.exp(np.cumsum(rng.normal(-0.5 * 0.25 ** 2 * step, 0.25 * np.sqrt(step), len(times))))
+        index_frames.append(pd.DataFrame({"时间": times, "品种": product, "收盘价": np.round(level, 2)}))
+        codes = np.array([f"{product}{month.strftime('%y%m')}" for month in months])
+        expiry = contract_expiry(codes)
+        listed_days = np.where(months.month % 3 == 0, 270, 62)
+        for code, expiry_day, listed in zip(codes, expiry, listed_days):
+            mask = (times.normalize() <= expiry_day) & (times.normalize() >= expiry_day - np.timedelta64(listed, "D"))
+            if not mask.any():
+                continue
+            tau = (expiry_day - times[mask].normalize()).days.to_numpy() / 365
+            discount = annual_discount * (1 + 0.3 * rng.standard_normal()) * tau
+            noise = rng.normal(0, 0.0005, mask.sum())
+            futures_frames.append(pd.DataFrame({"时间": times[mask], "合约代码": code,
+                                                "收盘价": np.round(level[mask] * (1 - discount + noise) / 0.2) * 0.2}))
+    return pd.concat(futures_frames, ignore_index=True), pd.concat(index_frames, ignore_index=True)
+
+
+def load_datas(args):
+    if args.synthetic_years:
+        futures_df, index_df = make_synthetic_history(args.synthetic_years, args.freq)
+    else:
+        futures_df, index_df = read_table(args.futures), read_table(args.index)
+    long_df = read_table(args.long) if args.long else None
+    return {product: BacktestData(futures_df, index_df, product, long_df, args.long_money) for product in args.product}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name in ("run", "sweep"):
+        sub = subparsers.add_parser(name)
+        sub.add_argument("--futures", help="期货行情文件")
+        sub.add_argument("--index", help="指数行情文件")
+        sub.add_argument("--long", help="多头持仓文件（可选）")
+        sub.add_argument("--long-money", type=float, default=1e8, help="固定的多头持仓（元）")
+        sub.add_argument("--product", nargs="+", default=["IM"], choices=list(core.INDEX_FUTURES_SPECS))
+        sub.add_argument("--synthetic-years", type=float, default=None, help="使用 N 年合成行情代替数据文件")
+        sub.add_argument("--freq", choices=("D", "min"), default="D", help="合成行情的周期")
+        sub.add_argument("--output", help="结果输出文件（.parquet 或 .csv）")
+    run_parser = subparsers.choices["run"]
+    run_parser.add_argument("--rank", type=int, default=1, help="持有到期日第几近的合约，0 为最近月")
+    run_parser.add_argument("--roll-days", type=int, default=3, help="到期前第几个交易日换月")
+    run_parser.add_argument("--hedge-ratio", type=float, default=1.0)
+    run_parser.add_argument("--rebalance", choices=("roll", "daily"), default="roll")
+    sweep_parser = subparsers.choices["sweep"]
+    sweep_parser.add_argument("--ranks", type=int, nargs="+", default=[0, 1, 2, 3])
+    sweep_parser.add_argument("--roll-days", type=int, nargs="+", default=[1, 3, 5])
+    sweep_parser.add_argument("--hedge-ratios", type=float, nargs="+", default=[0.9, 1.0, 1.1])
+    sweep_parser.add_argument("--rebalance", nargs="+", choices=("roll", "daily"), default=["roll"])
+    sweep_parser.add_argument("--workers", type=int, default=None, help="进程数，缺省为单进程")
+    args = parser.parse_args()
+    if not args.synthetic_years and not (args.futures and args.index):
+        parser.error("需要 --futures 与 --index，或使用 --synthetic-years")
+
+    start = time.perf_counter()
+    datas = load_datas(args)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    if args.command == "run":
+        result, summary = run_backtest(datas[args.product[0]], args.rank, args.roll_days, args.hedge_ratio, args.rebalance)
+        print(pd.Series(summary).to_string())
+    else:
+        result = run_sweep(datas, args.ranks, args.roll_days, args.hedge_ratios, args.rebalance, args.workers)
+        print(result.sort_values("对冲后日波动率（年化）").to_string(index=False, float_format="{:,.4g}".format))
+    print(f"加载 {load_seconds:.2f} 秒，回测 {time.perf_counter() - start:.2f} 秒")
+    if args.output:
+        export_result(result, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+"""性能基准脚本，不依赖网络与邮箱：
+
+    python benchmark.py solver          # 多合约对冲求解器 vs 单合约对冲表格
+    python benchmark.py parser DIR      # 净值邮件解析吞吐量（DIR 为保存的 .eml 邮件目录）
+    python benchmark.py mail            # 基于 IMAP 替身的完整同步流程：吞吐量、分阶段耗时、峰值内存
+    python benchmark.py startup         # 冷启动：模块导入、首屏渲染与每次 rerun 的耗时
+    python benchmark.py feed            # 模拟行情源故障：重试退避与熔断器 vs 原先的 10 次连续重试
+"""
+import argparse
+import collections
+import email
+import json
+import pathlib
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import hedging_core as core
+import mail_replay
+
+
+PRICE_TICK = 0.2  # 股指期货最小变动价位（点），1手市值因此都是 0.2 × 200 = 40 元的整数倍
+
+
+def round_to_tick(price):
+    return round(round(price / PRICE_TICK) * PRICE_TICK, 1)
+
+
+def make_synthetic_fees_table(seed=0):
+    """生成与 ak.futures_fees_info() 同结构的 IM/IC 四个月份合约行情，价格按最小变动价位取整"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for product, name, base in (("IM", "中证1000股指期货", 6000.0), ("IC", "中证500股指期货", 5700.0)):
+        for month in ("2412", "2501", "2503", "2506"):
+            pre_close = round_to_tick(base * rng.uniform(0.97, 1.0))
+            rows.append({
+                "合约代码": f"{product}{month}",
+                "合约名称": f"{name}{month}",
+                "最新价": round_to_tick(pre_close * rng.uniform(0.98, 1.02)),
+                "上日收盘价": pre_close,
+                "合约乘数": 200,
+                "持仓量": int(rng.integers(1000, 200000)),
+                "更新时间": "2024-12-02 10:00:00",
+            })
+    return pd.DataFrame(rows)
+
+
+def timeit(func, repeat):
+    """返回 func 多次运行的耗时中位数（毫秒）及最后一次的返回值"""
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed.append((time.perf_counter() - start) * 1000)
+    return float(np.median(elapsed)), result
+
+
+def bench_solver(args):
+    contracts = core.prepare_contract_snapshot(make_synthetic_fees_table(args.seed))
+    print(f"{'多头持仓（元）':>16} {'单合约表格(ms)':>14} {'求解器(ms)':>10} {'单合约最小未对冲':>16} {'求解器未对冲':>12}")
+    for long_money in args.notionals:
+        naive_ms, table = timeit(lambda: core.size_hedges([long_money], contracts), args.repeat)
+        solver_ms, (_lots, summary) = timeit(
+            lambda: core.solve_hedge_lots(long_money, contracts, resolution=args.resolution), args.repeat)
+        print(f"{long_money:>16,.0f} {naive_ms:>14.3f} {solver_ms:>10.3f} "
+              f"{table['未对冲总金额'].min():>16,} {summary['未对冲总金额']:>12,}")
+
+
+def load_mail_corpus(corpus_dir):
+    """读取目录（含子目录）下保存的邮件原文"""
+    paths = sorted(path for path in pathlib.Path(corpus_dir).rglob("*") if path.is_file() and not path.name.startswith("."))
+    return [path.read_bytes() for path in paths]
+
+
+def bench_parser(args):
+    raw_emails = load_mail_corpus(args.corpus)
+    if not raw_emails:
+        raise SystemExit(f"{args.corpus} 中没有邮件")
+    html_bodies = [part.get_payload(decode=True).decode('utf-8', errors='ignore')
+                   for raw_email in raw_emails for part in email.message_from_bytes(raw_email).walk()
+                   if part.get_content_type() == "text/html"]
+    new_infos = lambda: {key: {} for key in core.NAV_PRODUCT_KEYS}
+    mail_ms, _ = timeit(lambda: [core.parse_nav_mail(raw_email, new_infos()) for raw_email in raw_emails], args.repeat)
+    html_ms, _ = timeit(lambda: [core.parse_nav_html(body, new_infos()) for body in html_bodies], args.repeat)
+    print(f"邮件数：{len(raw_emails)}，HTML 正文数：{len(html_bodies)}")
+    print(f"整封邮件解析：{len(raw_emails) / mail_ms * 1000:,.0f} 封/秒（{mail_ms / len(raw_emails) * 1000:.1f} 微秒/封）")
+    print(f"HTML 正文解析：{len(html_bodies) / html_ms * 1000:,.0f} 个/秒（{html_ms / len(html_bodies) * 1000:.1f} 微秒/个）")
+
+
+class StageRecorder:
+    """收集 hedging_core.timed_stage 上报的各阶段耗时"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = collections.defaultdict(list)
+
+    def __call__(self, name, seconds, span=None):
+        with self.lock:
+            self.durations[name].append(seconds)
+
+    def __enter__(self):
+        core.STAGE_LISTENERS.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        core.STAGE_LISTENERS.remove(self)
+
+    def report(self):
+        print(f"{'阶段':<20} {'次数':>6} {'累计(ms)':>10} {'平均(ms)':>10} {'p95(ms)':>10}")
+        for name, durations in self.durations.items():
+            durations = np.array(durations) * 1000
+            print(f"{name:<22} {len(durations):>6} {durations.sum():>10.1f} {durations.mean():>10.3f} "
+                  f"{np.percentile(durations, 95):>10.3f}")
+
+
+def run_mail_sync(server, store_path, pool_size):
+    """对 IMAP 替身执行一次 extract_email，返回耗时（秒）与同步统计"""
+    core.IMAP_POOL_SIZE = pool_size
+    start = time.perf_counter()
+    *_result, sync_stats = core.extract_email(None, connect=server.connect, store=core.NavStore(store_path))
+    return time.perf_counter() - start, sync_stats
+
+
+def bench_mail(args):
+    if args.corpus:
+        messages = mail_replay.load_messages(args.corpus)
+    else:
+        messages = mail_replay.generate_corpus(args.days, mails_per_day=args.mails_per_day,
+                                               attachment_bytes=args.attachment_bytes)
+    server = mail_replay.FakeImapServer(messages, latency=args.latency / 1000)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store_path = pathlib.Path(tmp_dir) / "nav_store.sqlite3"
+        with StageRecorder() as recorder:
+            cold, sync_stats = run_mail_sync(server, store_path, args.pool_size)
+        warm, _sync_stats = run_mail_sync(server, store_path, args.pool_size)
+        print(f"邮件数：{len(messages)}，总大小：{sum(map(len, messages)) / 1e6:.2f} MB，"
+              f"模拟往返时延：{args.latency} ms，连接数：{args.pool_size}")
+        print(f"首次同步：{cold * 1000:.1f} ms（{len(messages) / cold:,.0f} 封/秒），增量同步（无新邮件）：{warm * 1000:.1f} ms")
+        print(f"服务器下发：{server.bytes_sent / 1e6:.2f} MB，命令数：{server.commands}")
+        print(f"正文下载：{sync_stats['下载字节数'] / 1e6:.2f} MB / 邮件总大小 {sync_stats['邮件总字节数'] / 1e6:.2f} MB，"
+              f"跳过附件与纯文本节省 {1 - sync_stats['下载字节数'] / max(sync_stats['邮件总字节数'], 1):.1%}")
+        recorder.report()
+
+        store_path.unlink()
+        tracemalloc.start()
+        run_mail_sync(server, store_path, args.pool_size)
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"首次同步峰值内存：{peak / 1e6:.2f} MB")
+
+
+class VirtualClock:
+    """虚拟时钟：sleep 只推进时间，模拟长时间故障时无需真实等待"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeFeed:
+    """本地模拟的行情源：outages 中的 [开始, 结束) 虚拟时间段内全部失败，其余时间按 failure_rate 随机失败，
+    hang 为 True 时请求阻塞 hang_seconds（真实时间）以触发超时"""
+
+    def __init__(self, clock, outages=(), failure_rate=0.0, latency=0.3, hang=False, hang_seconds=0.2, seed=0):
+        self.clock = clock
+        self.outages = outages
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.hang = hang
+        self.hang_seconds = hang_seconds
+        self.rng = np.random.default_rng(seed)
+        self.table = make_synthetic_fees_table(seed)
+        self.requests = 0
+
+    def __call__(self):
+        self.requests += 1
+        self.clock.sleep(self.latency)
+        if self.hang:
+            time.sleep(self.hang_seconds)
+        if any(start <= self.clock() < end for start, end in self.outages) or self.rng.random() < self.failure_rate:
+            raise ConnectionError("fake feed unavailable")
+        return self.table
+
+
+def legacy_feed(fetch):
+    """原先的实现：连续重试 10 次，没有退避"""
+    def load():
+        for _ in range(10):
+            try:
+                return fetch()
+            except Exception:
+                pass
+        return pd.DataFrame()
+    return load
+
+
+def simulate_feed(load, clock, duration, interval):
+    """每隔 interval（虚拟秒）取一次行情，返回 (拿到新数据次数, 只能提供旧快照次数)"""
+    fresh = stale = 0
+    while clock() < duration:
+        tick = clock()
+        if load().empty:
+            stale += 1
+        else:
+            fresh += 1
+        clock.now = max(clock(), tick + interval)
+    return fresh, stale
+
+
+def bench_feed(args):
+    outages = [(args.outage_start, args.outage_start + args.outage)]
+    print(f"模拟 {args.duration:.0f} 秒，每 {args.interval:.0f} 秒取一次行情，{outages[0][0]:.0f}~{outages[0][1]:.0f} 秒故障，"
+          f"其余时间失败率 {args.failure_rate:.0%}")
+    print(f"{'实现':<24} {'上游请求':>8} {'新数据':>6} {'旧快照':>6}")
+    for name in ("原实现（10 次连续重试）", "退避重试 + 熔断器"):
+        clock = VirtualClock()
+        feed = FakeFeed(clock, outages, args.failure_rate, seed=args.seed)
+        if name.startswith("原实现"):
+            load = legacy_feed(feed)
+        else:
+            load = core.ResilientFeed(feed, policy=core.RetryPolicy(timeout=None),
+                                    breaker=core.CircuitBreaker(reset_timeout=args.reset_timeout, clock=clock), sleep=clock.sleep)
+        fresh, stale = simulate_feed(load, clock, args.duration, args.interval)
+        print(f"{name:<24} {feed.requests:>8} {fresh:>6} {stale:>6}")
+    print(f"熔断器计数：{ {key: value for key, value in load.metrics.snapshot().items() if key != '请求耗时分布'} }")
+
+    # 请求挂起时单次超时生效（真实时间）
+    clock = VirtualClock()
+    feed = FakeFeed(clock, hang=True, hang_seconds=args.hang_seconds)
+    load = core.ResilientFeed(feed, policy=core.RetryPolicy(max_attempts=2, timeout=args.hang_seconds / 4), sleep=clock.sleep)
+    start = time.perf_counter()
+    data = load()
+    print(f"请求挂起 {args.hang_seconds * 1000:.0f} ms、超时 {args.hang_seconds / 4 * 1000:.0f} ms："
+          f"{(time.perf_counter() - start) * 1000:.0f} ms 后返回{'空表' if data.empty else '数据'}，"
+          f"超时次数 {load.metrics.snapshot()['超时次数']}")
+
+
+HEAVY_MODULES = ("akshare", "pandas", "numpy", "pypinyin", "cryptography", "imaplib")
+# 在全新进程中运行：只导入 AppTest，避免本脚本导入的 pandas/numpy 等掩盖应用自身的导入开销
+STARTUP_PROBE = """
+import json, statistics, sys, time
+from streamlit.testing.v1 import AppTest
+script, reruns, heavy = sys.argv[1], int(sys.argv[2]), sys.argv[3].split(",")
+preloaded = {name for name in heavy if name in sys.modules}
+start = time.perf_counter()
+app = AppTest.from_file(script, default_timeout=60)
+app.run()
+first_render = (time.perf_counter() - start) * 1000
+rerun_ms = []
+for _ in range(reruns):
+    start = time.perf_counter()
+    app.run()
+    rerun_ms.append((time.perf_counter() - start) * 1000)
+print(json.dumps({"first_render": first_render, "reruns": rerun_ms, "error": bool(app.exception),
+                  "loaded": sorted(name for name in heavy if name in sys.modules and name not in preloaded)}))
+"""
+
+
+def bench_startup(args):
+    script = pathlib.Path(args.script or pathlib.Path(__file__).with_name("index_hedging.py")).resolve()
+    import_ms, first_render_ms, rerun_ms = [], [], []
+    for _ in range(args.repeat):
+        # 每次都在新进程中运行，才能测到真正的冷启动
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {script.stem}"], check=True, cwd=script.parent,
+                       stderr=subprocess.DEVNULL)
+        import_ms.append((time.perf_counter() - start) * 1000)
+        probe = subprocess.run([sys.executable, "-c", STARTUP_PROBE, str(script), str(args.reruns), ",".join(HEAVY_MODULES)],
+                               check=True, capture_output=True, text=True, cwd=script.parent)
+        result = json.loads(probe.stdout.splitlines()[-1])
+        if result["error"]:
+            raise SystemExit("首屏渲染出错")
+        first_render_ms.append(result["first_render"])
+        rerun_ms += result["reruns"]
+    first_render = float(np.median(first_render_ms))
+    print(f"python -c 'import {script.stem}'（含解释器启动）：{np.median(import_ms):.0f} ms")
+    print(f"首屏渲染（AppTest 首次运行）：{first_render:.0f} ms")
+    print(f"每次 rerun：中位数 {np.median(rerun_ms):.1f} ms，p95 {np.percentile(rerun_ms, 95):.1f} ms")
+    print(f"首屏渲染时加载的重模块：{', '.join(result['loaded']) or '无'}")
+    if args.budget_ms is not None and first_render > args.budget_ms:
+        raise SystemExit(f"首屏渲染 {first_render:.0f} ms 超出预算 {args.budget_ms:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    solver_parser = subparsers.add_parser("solver", help="多合约对冲求解器延迟与未对冲金额")
+    solver_parser.add_argument("--notionals", type=float, nargs="+", default=[5e6, 3e7, 1e8, 5e8])
+    solver_parser.add_argument("--resolution", type=int, default=None)
+    solver_parser.add_argument("--repeat", type=int, default=20)
+    solver_parser.add_argument("--seed", type=int, default=0)
+    solver_parser.set_defaults(func=bench_solver)
+
+    parser_parser = subparsers.add_parser("parser", help="净值邮件解析吞吐量")
+    parser_parser.add_argument("corpus", help="保存的 .eml 邮件目录")
+    parser_parser.add_argument("--repeat", type=int, default=5)
+    parser_parser.set_defaults(func=bench_parser)
+
+    mail_parser = subparsers.add_parser("mail", help="净值邮件同步流程")
+    mail_parser.add_argument("--corpus", help="回放的 .eml 目录或 Maildir，缺省时生成合成邮件")
+    mail_parser.add_argument("--days", type=int, default=16)
+    mail_parser.add_argument("--mails-per-day", type=int, default=20)
+    mail_parser.add_argument("--attachment-bytes", type=int, default=0)
+    mail_parser.add_argument("--latency", type=float, default=5.0, help="模拟每条 IMAP 命令的往返时延（毫秒）")
+    mail_parser.add_argument("--pool-size", type=int, default=core.IMAP_POOL_SIZE)
+    mail_parser.set_defaults(func=bench_mail)
+
+    startup_parser = subparsers.add_parser("startup", help="冷启动与 rerun 耗时")
+    startup_parser.add_argument("--repeat", type=int, default=3, help="冷启动测量次数（每次一个新进程）")
+    startup_parser.add_argument("--reruns", type=int, default=20)
+    startup_parser.add_argument("--budget-ms", type=float, default=None, help="首屏渲染耗时预算，超出时以非零状态退出")
+    startup_parser.add_argument("--script", help="被测的 Streamlit 脚本，缺省为 index_hedging.py")
+    startup_parser.set_defaults(func=bench_startup)
+
+    feed_parser = subparsers.add_parser("feed", help="行情源故障下的重试与熔断")
+    feed_parser.add_argument("--duration", type=float, default=3600, help="模拟时长（虚拟秒）")
+    feed_parser.add_argument("--interval", type=float, default=10, help="取行情的间隔（虚拟秒）")
+    feed_parser.add_argument("--outage-start", type=float, default=600)
+    feed_parser.add_argument("--outage", type=float, default=1200, help="故障持续时长（虚拟秒）")
+    feed_parser.add_argument("--failure-rate", type=float, default=0.05)
+    feed_parser.add_argument("--reset-timeout", type=float, default=60)
+    feed_parser.add_argument("--hang-seconds", type=float, default=0.4)
+    feed_parser.add_argument("--seed", type=int, default=0)
+    feed_parser.set_defaults(func=bench_feed)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
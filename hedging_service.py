@@ -0,0 +1,292 @@
+"""对冲手数与净值快照的命令行与本地 HTTP/JSON 服务，不依赖 Streamlit，供定时任务与其他服务调用：
+
+    python hedging_service.py hedge 3000                     # 多头持仓 3000 万元时各 IM/IC 合约的对冲手数
+    python hedging_service.py hedge 3000 --solve             # 另附跨合约组合求解（未对冲金额最小）的手数
+    python hedging_service.py nav --account 默认账户          # 同步邮箱，输出最新净值与账户汇总
+    python hedging_service.py holdings-hedge                 # 持仓（计提前金额 × 杠杆系数）所需的对冲手数
+    python hedging_service.py serve --port 8765              # 本地 HTTP 服务
+
+HTTP 接口（GET，返回 JSON；HTTP/1.1 长连接，客户端可复用连接连续请求）：
+
+    /hedge?long_money=3000&solve=1                           同 hedge，solve=1 时附带组合求解结果
+    /nav?account=默认账户                                     同 nav，读取后台轮询的净值快照
+    /holdings-hedge?account=默认账户&beta.kai_du_info=1.2     同 holdings-hedge，beta.产品键 临时覆盖杠杆系数
+    /health                                                  行情快照、后台任务与熔断器状态
+    /traces                                                  最近调用链各阶段耗时的 p50/p95（毫秒）
+
+行情与净值都来自 hedging_core 的进程内缓存（SnapshotCache、后台调度线程），重复请求只做毫秒级的向量化计算。
+净值相关命令需要邮箱密码（环境变量 NAV_SECRET_KEY），设置了 NAV_MAIL_REPLAY_DIR 时回放本地邮件、不需要密码。
+/nav 与 /holdings-hedge 返回持仓数据，须带请求头 Authorization: Bearer <HEDGING_SERVICE_TOKEN>；
+未设置环境变量 HEDGING_SERVICE_TOKEN 时这两个接口一律拒绝，且服务只允许监听本机回环地址。
+"""
+import argparse
+import hmac
+import ipaddress
+import json
+import math
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import hedging_core as core
+
+
+class ServiceError(Exception):
+    """带 HTTP 状态码的请求错误"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def frame_records(df):
+    """DataFrame（连同索引）转为 JSON 记录列表：numpy 类型转为内置类型，NaN 转为 null"""
+    return json.loads(df.reset_index().to_json(orient="records", force_ascii=False))
+
+
+SERVICE_TOKEN = os.environ.get("HEDGING_SERVICE_TOKEN")  # 持仓接口的访问令牌
+
+
+def format_timestamp(timestamp):
+    """时间戳格式化为北京时间，带时区标记"""
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone(timedelta(hours=8))).isoformat(sep=" ", timespec="seconds")
+
+
+def current_nav(use_scheduler=True):
+    """返回 (净值快照 DataFrame, 完成时间戳)：服务读取后台轮询的结果，命令行当场同步一次"""
+    secret_key = os.environ.get("NAV_SECRET_KEY")
+    if not os.environ.get("NAV_MAIL_REPLAY_DIR") and not core.verify_secret_key(secret_key):
+        raise ServiceError(403, "未设置 NAV_SECRET_KEY 或密码错误")
+    if use_scheduler:
+        (nav_df, _sync_stats), finished_at = core.get_nav_result(secret_key)
+    else:
+        (nav_df, _sync_stats), finished_at = core.load_nav_snapshot(secret_key), time.time()
+    return nav_df, finished_at
+
+
+def current_snapshot():
+    """进程内缓存的行情快照，没有可用行情时返回 503"""
+    with core.timed_stage("futures.snapshot"):
+        snapshot = core.get_futures_snapshot_cache().get()
+    if snapshot.empty:
+        raise ServiceError(503, "无法获取期货数据")
+    return snapshot
+
+
+def hedge_payload(long_money, solve=False):
+    try:
+        long_money = float(str(long_money).replace(",", ""))
+    except ValueError:
+        long_money = 0
+    if not math.isfinite(long_money) or long_money <= 0:
+        raise ServiceError(400, "long_money 应为正数（万元）")
+    snapshot = current_snapshot()
+    table, update_time = core.generate_table(long_money, snapshot)
+    snapshot_cache = core.get_futures_snapshot_cache()
+    payload = {
+        "多头持仓（万元）": long_money,
+        "期货数据更新时间": update_time,
+        "行情快照秒数": snapshot_cache.age(),
+        "行情快照过期": snapshot_cache.is_stale(),
+        "合约": json.loads(table.to_json(orient="records", force_ascii=False)),
+    }
+    if solve:
+        lots_df, summary = core.generate_combination(long_money, snapshot)
+        payload["组合求解"] = {"汇总": summary, "合约": json.loads(lots_df.to_json(orient="records", force_ascii=False))}
+    return payload
+
+
+def nav_payload(account=None, use_scheduler=True):
+    nav_df, finished_at = current_nav(use_scheduler)
+    try:
+        details, totals = core.account_holdings(nav_df, account)
+    except KeyError:
+        raise ServiceError(404, f"账户 {account} 不存在")
+    return {
+        "账户": totals.name,
+        "持仓数据时间": format_timestamp(finished_at),
+        "汇总": json.loads(totals.to_json(force_ascii=False)),
+        "缺少净值": core.missing_nav_products(details),  # 未计入汇总金额的产品
+        "持仓": frame_records(details),
+    }
+
+
+def holdings_hedge_payload(account=None, beta_overrides=None, use_scheduler=True):
+    nav_df, finished_at = current_nav(use_scheduler)
+    snapshot = current_snapshot()
+    betas = core.portfolio_betas(core.PORTFOLIO_CONFIG["accounts"])
+    account = betas.index[0][0] if account is None else account
+    if account not in betas.index.get_level_values("账户"):
+        raise ServiceError(404, f"账户 {account} 不存在")
+    for key, value in (beta_overrides or {}).items():
+        if (account, key) not in betas.index:
+            raise ServiceError(400, f"账户 {account} 未持有产品 {key}")
+        try:
+            beta = float(value)
+        except ValueError:
+            beta = math.nan
+        if not math.isfinite(beta) or beta < 0:
+            raise ServiceError(400, f"beta.{key} 应为非负数")
+        betas.loc[(account, key)] = beta
+    exposure, sized = core.get_holdings_hedge(nav_df, snapshot, tuple(betas.to_numpy()))
+    exposure = exposure.loc[account]
+    contracts = core.get_contract_snapshot(snapshot).set_index("合约代码")[["合约名称", "1手市值", "最新价"]]
+    return {
+        "账户": account,
+        "持仓数据时间": format_timestamp(finished_at),
+        "期货数据更新时间": snapshot["更新时间"].iloc[-1],
+        "多头敞口": float(exposure["多头敞口"].sum()),
+        "缺少净值": core.missing_nav_products(exposure),  # 未计入多头敞口的产品
+        "敞口明细": frame_records(exposure),
+        "合约": frame_records(contracts.join(sized.loc[account])),
+    }
+
+
+def health_payload():
+    snapshot_cache = core.get_futures_snapshot_cache()
+    scheduler = core.get_scheduler()
+    jobs = {}
+    for name in ("futures", "nav"):
+        if name in scheduler:
+            error = scheduler.last_error(name)
+            jobs[name] = {"完成时间": format_timestamp(scheduler.latest(name)[1]),
+                          "最近错误": None if error is None else f"{type(error).__name__}: {error}"}
+    return {
+        "行情快照秒数": snapshot_cache.age(),
+        "行情快照过期": snapshot_cache.is_stale(),
+        "行情源": snapshot_cache.loader.last_source,
+        "熔断器": {name: feed.breaker.state for name, feed in snapshot_cache.loader.feeds.items()},
+        "后台任务": jobs,
+    }
+
+
+def traces_payload():
+    trace_log = core.get_trace_log()
+    summary = trace_log.stage_summary()
+    counters = trace_log.counter_summary()
+    return {
+        "阶段耗时": [] if summary.empty else frame_records(summary),
+        "计数器": [] if counters.empty else frame_records(counters),
+    }
+
+
+ROUTES = {
+    "/hedge": lambda params: hedge_payload(params.get("long_money", ""), params.get("solve", "") in ("1", "true")),
+    "/nav": lambda params: nav_payload(params.get("account")),
+    "/holdings-hedge": lambda params: holdings_hedge_payload(
+        params.get("account"), {name[len("beta."):]: value for name, value in params.items() if name.startswith("beta.")}),
+    "/health": lambda params: health_payload(),
+    "/traces": lambda params: traces_payload(),
+}
+PROTECTED_ROUTES = {"/nav", "/holdings-hedge"}  # 返回持仓数据，需要访问令牌
+
+
+def check_token(authorization):
+    """校验 Authorization 请求头中的 Bearer 令牌，未配置令牌时一律拒绝"""
+    if not SERVICE_TOKEN:
+        raise ServiceError(403, "未设置 HEDGING_SERVICE_TOKEN，持仓接口不可用")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), SERVICE_TOKEN.encode()):
+        raise ServiceError(401, "缺少或错误的访问令牌")
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class HedgingRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 长连接：响应都带 Content-Length，同一连接可连续请求
+    disable_nagle_algorithm = True  # 响应头与正文分两次写出，关闭 Nagle 以免每个请求多等一个延迟 ACK（约 40 ms）
+    quiet = True  # 高频调用时不逐条打印访问日志
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        route = ROUTES.get(url.path)
+        with core.timed_stage(f"http{url.path}" if route else "http.not_found"):
+            try:
+                if route is None:
+                    raise ServiceError(404, f"未知接口 {url.path}")
+                if url.path in PROTECTED_ROUTES:
+                    check_token(self.headers.get("Authorization"))
+                status, payload = 200, route(dict(urllib.parse.parse_qsl(url.query)))
+            except ServiceError as e:
+                status, payload = e.status, {"错误": str(e)}
+            except Exception as e:
+                status, payload = 500, {"错误": f"{type(e).__name__}: {e}"}
+            body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+def serve(host, port, verbose=False):
+    if not SERVICE_TOKEN and not is_loopback(host):
+        raise SystemExit(f"未设置 HEDGING_SERVICE_TOKEN 时只允许监听本机回环地址，拒绝监听 {host}")
+    core.get_trace_log()
+    core.get_scheduler()  # 设置了 NAV_MAIL_REPLAY_DIR 时启动净值轮询
+    # 服务启动即在后台拉取首个行情快照（此后由调度线程定时刷新），首个请求不必等待
+    threading.Thread(target=core.get_futures_snapshot_cache().get, name="futures-warmup", daemon=True).start()
+    HedgingRequestHandler.quiet = not verbose
+    server = ThreadingHTTPServer((host, port), HedgingRequestHandler)
+    server.daemon_threads = True
+    print(f"对冲服务已启动：http://{host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    hedge_parser = subparsers.add_parser("hedge")
+    hedge_parser.add_argument("long_money", help="考虑杠杆的多头持仓（万元）")
+    hedge_parser.add_argument("--solve", action="store_true", help="附带跨合约组合求解（未对冲金额最小）的手数")
+    for name in ("nav", "holdings-hedge"):
+        sub = subparsers.add_parser(name)
+        sub.add_argument("--account", help="账户名，缺省为持仓配置中的第一个账户")
+    subparsers.choices["holdings-hedge"].add_argument("--beta", nargs=2, action="append", default=[],
+                                                      metavar=("产品键", "系数"), help="临时覆盖某个产品的杠杆系数")
+    serve_parser = subparsers.add_parser("serve")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--verbose", action="store_true", help="打印访问日志")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.host, args.port, args.verbose)
+        return
+    try:
+        if args.command == "hedge":
+            payload = hedge_payload(args.long_money, args.solve)
+        elif args.command == "nav":
+            payload = nav_payload(args.account, use_scheduler=False)
+        else:
+            payload = holdings_hedge_payload(args.account, dict(args.beta), use_scheduler=False)
+    except ServiceError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(payload, ensure_ascii=False, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,421 +1,100 @@
-import akshare as ak
 import pandas as pd
-from pypinyin import pinyin, Style
 import streamlit as st
 from datetime import datetime, timedelta, timezone
-import re
-import imaplib
-import email
-from email.utils import parsedate_to_datetime
-from email.header import make_header, decode_header
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import padding, hashes
+import time
 
-def hash_string(input_string, algorithm=hashes.SHA512):
-    data = input_string.encode('utf-8')
-    digest = hashes.Hash(algorithm(), backend=default_backend())
-    digest.update(data)
-    hash_bytes = digest.finalize()
-    return hash_bytes.hex()
+import hedging_core as core
+# 页面只负责展示与交互：行情、对冲计算、净值同步与持仓汇总都在 hedging_core 中，
+# 与命令行/本地 HTTP 服务（hedging_service.py）共用
 
-def decrypt_string(encrypted_data, key):
-    key = key.ljust(16, b'\0')
-    iv = encrypted_data[:16]
-    ciphertext = encrypted_data[16:]
-    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-    decryptor = cipher.decryptor()
-    decrypted_data = decryptor.update(ciphertext) + decryptor.finalize()
-    unpadder = padding.PKCS7(128).unpadder()
-    original_data = unpadder.update(decrypted_data) + unpadder.finalize()
-    return original_data.decode()
 
 def fetch_futures_fees_info():
     error_placeholder = st.empty()  # 创建一个占位符
-    for i in range(10):  # 尝试10次
-        try:
-            data = ak.futures_fees_info()
-        except Exception as e:
-            error_placeholder.write(f"第 {i+1} 次获取期货数据失败，正在重试...")
-        else:
-            error_placeholder.empty()  # 清除错误信息
-            return data
-    error_placeholder.write("多次尝试获取期货数据失败，请检查网络后重试。")
-    return pd.DataFrame()
-
-def generate_table(long_money):
-    """生成表格"""
-    long_money = float(long_money)*10000
-    futures_fees_info_df = fetch_futures_fees_info()
+    on_retry = lambda i: error_placeholder.write(f"第 {i+1} 次获取期货数据失败，正在重试...")
+    snapshot_cache = core.get_futures_snapshot_cache()
+    with core.timed_stage("futures.snapshot"):
+        data = snapshot_cache.get(on_retry=on_retry)
+    if data.empty:
+        error_placeholder.write("多次尝试获取期货数据失败，请检查网络后重试。")
+    elif snapshot_cache.is_stale():
+        breaker_states = "，".join(f"{name}：{feed.breaker.state}" for name, feed in snapshot_cache.loader.feeds.items())
+        error_placeholder.warning(f"期货数据源暂不可用（熔断器 {breaker_states}），"
+                                  f"以下为 {snapshot_cache.age():.0f} 秒前的旧快照。")
+    else:
+        error_placeholder.empty()  # 清除错误信息
+    return data
 
-    if futures_fees_info_df.empty:
-        return pd.DataFrame(), None
 
-    # 以下为表格计算代码
-    futures_fees_info_df = futures_fees_info_df[futures_fees_info_df['合约代码'].str.contains('IM|IC', regex=True)]
-    futures_fees_info_df["做多保证金率（按金额）"] = pd.Series(0.14, index=futures_fees_info_df.index, dtype='float32')
-    for index, row in futures_fees_info_df.iterrows():
-        row["最新价"] = row["最新价"] if row["最新价"] > 100 else row["上日收盘价"]
-        futures_fees_info_df.loc[index,"最新价"] = row["最新价"]
-        futures_fees_info_df.loc[index,"1手市值"] = int(row["最新价"] * row["合约乘数"])
-        futures_fees_info_df.loc[index,"做多1手保证金"] = int(row["最新价"] * row["合约乘数"] * row["做多保证金率（按金额）"])
+def show_feed_metrics():
+    # 打印各期货行情源的重试与熔断计数
+    fallback_feed = core.get_futures_snapshot_cache().loader
+    with st.expander("期货数据源状态"):
+        st.write(f"当前行情源：{fallback_feed.last_source}")
+        for name, feed in fallback_feed.feeds.items():
+            metrics = feed.metrics.snapshot()
+            st.write(f"{name}（熔断器：{feed.breaker.state}）")
+            st.table(pd.Series({key: value for key, value in metrics.items() if key not in ("请求耗时分布", "最近错误")},
+                               name="次数"))
+            st.bar_chart(pd.Series(metrics["请求耗时分布"], name="请求数"))
+            if metrics["最近错误"]:
+                st.caption(f"最近错误：{metrics['最近错误']}")
 
-    futures_fees_info_df["最新价"] = futures_fees_info_df["最新价"].astype(float)
-    futures_fees_info_df["实时涨跌幅"] = (futures_fees_info_df["最新价"] / futures_fees_info_df["上日收盘价"] - 1).apply(lambda x: f"{x:+.2%}")
-    update_time = futures_fees_info_df["更新时间"].iloc[-1]
 
-    futures_fees_info_df["需做空（手）"] = (long_money // futures_fees_info_df["1手市值"]).astype('int64')
-    futures_fees_info_df["已对冲总金额"] = (futures_fees_info_df["需做空（手）"] * futures_fees_info_df["1手市值"]).astype('int64')
-    futures_fees_info_df["未对冲总金额"] = (long_money - futures_fees_info_df["已对冲总金额"]).astype('int64')
-    futures_fees_info_df["对冲账户所需保证金"] = (futures_fees_info_df["已对冲总金额"] * row["做多保证金率（按金额）"]).astype('int64')
-    futures_fees_info_df["对冲账户所需总权益"] = (futures_fees_info_df["对冲账户所需保证金"] + long_money * 0.1).astype('int64')
-    futures_fees_info_df = futures_fees_info_df.filter(items=["合约代码", "合约名称", "1手市值",
-                                                              "需做空（手）", "已对冲总金额", "未对冲总金额",
-                                                              "对冲账户所需总权益", "对冲账户所需保证金",
-                                                              "上日收盘价", "最新价", "实时涨跌幅", "持仓量", "合约乘数", "做多保证金率（按金额）", "做多1手保证金"])
-    futures_fees_info_df["做多保证金率（按金额）"] = futures_fees_info_df["做多保证金率（按金额）"].apply(lambda x: f"{x:.2%}")
-    futures_fees_info_df = futures_fees_info_df.rename(columns={"1手市值":"1手合约市值（元）", "持仓量":"市场总持仓量", "做多保证金率（按金额）":"保证金率"})
-    return futures_fees_info_df, update_time
+def show_nav_history():
+    # 打印本地净值库中的历史净值走势
+    history_df = core.get_nav_store().history()
+    if history_df.empty:
+        return
+    history_df["收件时间"] = pd.to_datetime(history_df["mail_ts"], unit="s", utc=True).dt.tz_convert("Asia/Shanghai")
+    with st.expander("历史净值"):
+        st.write("虚拟净值")
+        st.line_chart(history_df.pivot_table(index="收件时间", columns="产品名称", values="虚拟净值"))
+        st.write("当期业绩报酬")
+        st.line_chart(history_df.pivot_table(index="收件时间", columns="产品名称", values="当期业绩报酬"))
 
-def extract_email(secret_key):
-    email_value_config = {
-        'imap_server': b'\xc5\xe5\xa2Q\xd1LQ[\x1b\xda<z\xacf\x8env\x8dH\x90U\x86\xc9^H\xb3\x83\xa1\xb0\x10\x85t',
-        'username': b'\x13\x8c:g3\xfa\x84\xb8\xbc\xc2f\x0b\xcd\xe7\xde\x16\x17\x84\xc9\xd5\x9aj\x1elC\x86\x0e\xd4\x87\x19\xa4;\xc9\xb6\x01\xd0\xa5M\xb4\x0e\xbf\xb6"\x9c|)\x1e ',
-        'password': b'\x86\x9b([\x0bg\x0f#\xad~c\x13k]\x91\xb6\xde]\xcd\xf6:Uq<T\x0b}!\x89\x06#!\xe79V\x8d\xe4S\xb9}\xc1.\x1c\xc2\x1e\x0f\xebf',
-    }
-    email_server = imaplib.IMAP4_SSL(decrypt_string(email_value_config['imap_server'], secret_key.encode('utf-8')))
-    email_server.login(decrypt_string(email_value_config["username"], secret_key.encode('utf-8')), decrypt_string(email_value_config['password'], secret_key.encode('utf-8')))
-    email_server.select('INBOX')  # 选择【收件箱】
-    # 选择收件箱
-    beijing_time = datetime.utcnow() + timedelta(hours=8)
-    sixteen_days_ago = (beijing_time - timedelta(days=16)).strftime('%d-%b-%Y')
-    _typ, _search_data = email_server.search(None,
-                                             'SINCE', sixteen_days_ago,
-                                             'SUBJECT', ("净值".encode('utf-8')),
-                                             'SUBJECT', ("虚拟".encode('utf-8')))
-    # 开始解析
-    mailidlist = _search_data[0].split()  # 转成标准列表,获得所有邮件的ID
+@st.fragment(run_every=core.MONITOR_INTERVAL)
+def show_holdings_hedge(account_name):
+    # 持仓对冲：直接读取后台预热的净值快照与缓存的行情快照，任一更新或系数被修改时才重算
+    st.subheader("持仓对冲")
+    nav_result, nav_ts = core.get_scheduler().latest("nav")
+    snapshot = core.get_futures_snapshot_cache().get()
+    if nav_result is None or snapshot.empty:
+        st.write("暂无持仓或期货数据，请稍后刷新。")
+        return
+    nav_df = nav_result[0]
+    default_betas = core.portfolio_betas(core.PORTFOLIO_CONFIG["accounts"])
+    betas = default_betas.loc[[account_name]]
+    betas_df = pd.DataFrame({"杠杆系数": betas.to_numpy()}, index=betas.index.get_level_values("产品键"))
+    edited = st.data_editor(betas_df, key=f"holdings_betas_{account_name}",
+                            column_config={"杠杆系数": st.column_config.NumberColumn(min_value=0.0, step=0.05, format="%.2f")})
+    betas = default_betas.copy()
+    betas.loc[account_name] = edited["杠杆系数"].fillna(1.0).to_numpy()
 
-    # 按日期降序排序
-    mail_with_dates = []
-    for mail_id in mailidlist:
-        # 获取邮件的头部数据
-        _typ, msg_data = email_server.fetch(mail_id, '(BODY[HEADER.FIELDS (DATE)])')
-        # 提取日期字段
-        for response_part in msg_data:
-            if isinstance(response_part, tuple):
-                # 获取头部信息
-                header_data = response_part[1].decode('utf-8')
-                # 从头部提取日期
-                date_str = header_data.split("Date: ")[-1].strip()
-                mail_date = parsedate_to_datetime(date_str)  # 转为 datetime 对象
-                mail_with_dates.append((mail_id, mail_date))
-    # 按时间降序排序
-    sorted_mail_with_dates = sorted(mail_with_dates, key=lambda x: x[1], reverse=True)
-    # 提取排序后的邮件 ID 列表
-    sorted_mailidlist = [mail[0] for mail in sorted_mail_with_dates]
+    # 快照与系数都未变时 get_holdings_hedge 直接返回上次的结果
+    exposure, sized = core.get_holdings_hedge(nav_df, snapshot, tuple(betas.to_numpy()))
+    exposure, sized = exposure.loc[account_name], sized.loc[account_name]
+    contracts = core.get_contract_snapshot(snapshot)
 
-    # 解析内容：
-    wei_guan_info_a, wei_guan_info_b, qing_yan_he_xin_info, qing_yan_jie_bei_info, wan_yan_1_info, kai_du_info, liang_chuang_info, wan_yan_3_info, han_rong_info, zheng_ding_info, hui_jin_info, meng_xi_info = {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}
-    for mail_id in sorted_mailidlist:
-        result, data = email_server.fetch(mail_id, '(RFC822)')  # 通过邮件id获取邮件
-        email_message = email.message_from_bytes(data[0][1])  # 邮件内容（未解析）
-        subject = make_header(decode_header(email_message['SUBJECT']))  # 主题
-        mail_from = make_header(decode_header(email_message['From']))  # 发件人
-        mail_dt = parsedate_to_datetime(email_message['Date'])  # 收件时间
-        email_info = {
-            "主题": str(subject),
-            "发件人": str(mail_from),
-            "收件时间": mail_dt,
-        }
-        # print(email_info)
+    st.write(f"多头敞口（计提前金额 × 杠杆系数）：{exposure['多头敞口'].sum():,.2f}")
+    missing = core.missing_nav_products(exposure)
+    if missing:
+        st.warning(f"以下产品暂无净值，未计入多头敞口：{'、'.join(missing)}")
+    table = contracts.set_index("合约代码")[["合约名称", "1手市值", "最新价"]].join(sized)
+    st.dataframe(table.style.format({"1手市值": "{:,.0f}", "最新价": "{:.1f}", "已对冲总金额": "{:,.0f}",
+                                     "未对冲总金额": "{:,.0f}", "对冲账户所需保证金": "{:,.0f}", "对冲账户所需总权益": "{:,.0f}"}),
+                 use_container_width=True)
+    st.caption(f"持仓数据：{core.format_data_age(nav_ts)}；期货数据刷新时间：{snapshot['更新时间'].iloc[-1]}")
 
-        # 提取邮件正文内容
-        # 邮件可能包含多个部分（例如，文本部分和HTML部分），我们需要遍历所有部分
 
-        if email_message.is_multipart():
-            for part in email_message.walk():  # 使用 walk() 方法遍历所有部分
-                content_type = part.get_content_type()  # 获取当前部分的类型
-                content_disposition = str(part.get("Content-Disposition"))  # 获取当前部分的附件信息
+def show_hedge_combination(long_money):
+    # 打印跨 IM/IC 各月份合约联合求解的整数手数：单合约整手对冲的未对冲金额可达一手市值，组合求解通常只剩几十元
+    lots_df, summary = core.generate_combination(long_money, core.get_futures_snapshot_cache().get())
+    with st.expander(f"组合对冲（共 {summary['需做空（手）']} 手，未对冲 {summary['未对冲总金额']:,} 元）"):
+        st.dataframe(lots_df.set_index("合约代码", drop=True).style.format(
+            {"1手市值": "{:,.0f}", "已对冲总金额": "{:,.0f}", "对冲账户所需保证金": "{:,.0f}"}), use_container_width=True)
+        st.write(f"已对冲总金额：{summary['已对冲总金额']:,}；对冲账户所需保证金：{summary['对冲账户所需保证金']:,}；"
+                 f"对冲账户所需总权益：{summary['对冲账户所需总权益']:,}")
 
-                # 如果是文本部分且不是附件，则打印正文内容
-                if "attachment" not in content_disposition:
-                    if content_type == "text/plain":  # 纯文本邮件
-                        body = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                        # print("邮件正文（纯文本）:")
-                        # print(body)
-                    elif content_type == "text/html":  # HTML格式邮件
-                        body = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                        # print("净值信息：")
-                        get_initials = lambda text: ''.join(
-                            map(lambda x: x[0].upper(), pinyin(text, style=Style.FIRST_LETTER))
-                        )
-                        #wei guan a
-                        if re.search(b'\xe8\x99\x9a\xe6\x8b\x9f.*\xe5\xbe\xae\xe8\xa7\x82.*\xe5\xbf\x97'.decode('utf-8'), body, re.DOTALL):
-                            td_contents = re.findall(r'<td>(.*?)</td>', body, flags=re.DOTALL)
-                            # print(td_contents)
-                            ming_cheng = td_contents[1]
-                            jing_zhi_ri_qi = datetime.strptime(td_contents[2], "%Y%m%d").strftime("%Y-%m-%d")
-                            fen_e = float(td_contents[6].replace(',',''))
-                            dan_wei_jing_zhi = float(td_contents[7].replace(',',''))
-                            xu_ni_jing_zhi = float(td_contents[10].replace(',',''))
-                            ji_ti_qian_jin_e = float(td_contents[5].replace(',',''))
-                            ji_ti_hou_jin_e = ji_ti_qian_jin_e - float(td_contents[9].replace(',',''))
-                            dang_qi_ye_ji_bao_chou = float(td_contents[9].replace(',',''))
-                            if not (wei_guan_info_a.get('产品名称', 0)):
-                                wei_guan_info_a['产品名称'] = get_initials(ming_cheng[:2]) + ".a"
-                                wei_guan_info_a['净值日期'] = jing_zhi_ri_qi
-                                wei_guan_info_a['持有份额'] = fen_e
-                                wei_guan_info_a['单位净值'] = dan_wei_jing_zhi
-                                wei_guan_info_a['虚拟净值'] = xu_ni_jing_zhi
-                                wei_guan_info_a['计提前金额'] = ji_ti_qian_jin_e
-                                wei_guan_info_a['计提后金额'] = ji_ti_hou_jin_e
-                                wei_guan_info_a['当期业绩报酬'] = dang_qi_ye_ji_bao_chou
-                        #wei guan b
-                        if re.search(b'\xe8\x99\x9a\xe6\x8b\x9f.*\xe5\xbe\xae\xe8\xa7\x82.*\xe5\xbf\xb1'.decode('utf-8'), body, re.DOTALL):
-                            td_contents = re.findall(r'<td>(.*?)</td>', body, flags=re.DOTALL)
-                            # print(td_contents)
-                            ming_cheng = td_contents[1]
-                            jing_zhi_ri_qi = datetime.strptime(td_contents[2], "%Y%m%d").strftime("%Y-%m-%d")
-                            fen_e = float(td_contents[6].replace(',',''))
-                            dan_wei_jing_zhi = float(td_contents[7].replace(',',''))
-                            xu_ni_jing_zhi = float(td_contents[10].replace(',',''))
-                            ji_ti_qian_jin_e = float(td_contents[5].replace(',',''))
-                            ji_ti_hou_jin_e = ji_ti_qian_jin_e - float(td_contents[9].replace(',',''))
-                            dang_qi_ye_ji_bao_chou = float(td_contents[9].replace(',',''))
-                            if not (wei_guan_info_b.get('产品名称', 0)):
-                                wei_guan_info_b['产品名称'] = get_initials(ming_cheng[:2]) + ".b"
-                                wei_guan_info_b['净值日期'] = jing_zhi_ri_qi
-                                wei_guan_info_b['持有份额'] = fen_e
-                                wei_guan_info_b['单位净值'] = dan_wei_jing_zhi
-                                wei_guan_info_b['虚拟净值'] = xu_ni_jing_zhi
-                                wei_guan_info_b['计提前金额'] = ji_ti_qian_jin_e
-                                wei_guan_info_b['计提后金额'] = ji_ti_hou_jin_e
-                                wei_guan_info_b['当期业绩报酬'] = dang_qi_ye_ji_bao_chou
-                        #qing yan he xin
-                        if re.search(b'\xe8\x99\x9a\xe6\x8b\x9f.*\xe9\x9d\x92\xe7\x90\xb0\xe5\x90\x88\xe4\xbf\xa1'.decode('utf-8'), body, re.DOTALL):
-                            td_contents = re.findall(r'padding:5px;\'>(.*?)</td>', body, flags=re.DOTALL)
-                            # print(td_contents)
-                            ming_cheng = b'\xe9\x9d\x92\xe7\x90\xb0\xe5\x90\x88\xe4\xbf\xa1'.decode('utf-8')
-                            jing_zhi_ri_qi = datetime.strptime(td_contents[2], "%Y-%m-%d").strftime("%Y-%m-%d")
-                            fen_e = float(td_contents[4].replace(',',''))
-                            dan_wei_jing_zhi = float(td_contents[7].replace(',',''))
-                            xu_ni_jing_zhi = float(td_contents[6].replace(',',''))
-                            ji_ti_qian_jin_e = fen_e * dan_wei_jing_zhi
-                            dang_qi_ye_ji_bao_chou = float(td_contents[5].replace(',',''))
-                            ji_ti_hou_jin_e = ji_ti_qian_jin_e - dang_qi_ye_ji_bao_chou
-                            if not (qing_yan_he_xin_info.get('产品名称', 0)):
-                                qing_yan_he_xin_info['产品名称'] = f"{get_initials(ming_cheng[:2])}({get_initials(ming_cheng[2:4])})"
-                                qing_yan_he_xin_info['净值日期'] = jing_zhi_ri_qi
-                                qing_yan_he_xin_info['持有份额'] = fen_e
-                                qing_yan_he_xin_info['单位净值'] = dan_wei_jing_zhi
-                                qing_yan_he_xin_info['虚拟净值'] = xu_ni_jing_zhi
-                                qing_yan_he_xin_info['计提前金额'] = ji_ti_qian_jin_e
-                                qing_yan_he_xin_info['计提后金额'] = ji_ti_hou_jin_e
-                                qing_yan_he_xin_info['当期业绩报酬'] = dang_qi_ye_ji_bao_chou
-                        #qing yan jie bei
-                        if re.search(b'\xe8\x99\x9a\xe6\x8b\x9f.*\xe9\x9d\x92\xe7\x90\xb0\xe6\x8d\xb7\xe5\x8c\x97'.decode('utf-8'), body, re.DOTALL):
-                            td_contents = re.findall(r'left:10px">(.*?)</td>', body, flags=re.DOTALL)
-                            # print(td_contents)
-                            ming_cheng = td_contents[1]
-                            jing_zhi_ri_qi = datetime.strptime(td_contents[2], "%Y%m%d").strftime("%Y-%m-%d")
-                            fen_e = float(td_contents[5].replace(',',''))
-                            dan_wei_jing_zhi = float(td_contents[6].replace(',',''))
-                            xu_ni_jing_zhi = float(td_contents[8].replace(',',''))
-                            ji_ti_qian_jin_e = fen_e * dan_wei_jing_zhi
-                            dang_qi_ye_ji_bao_chou = float(td_contents[9])
-                            ji_ti_hou_jin_e = ji_ti_qian_jin_e - dang_qi_ye_ji_bao_chou
-                            if not (qing_yan_jie_bei_info.get('产品名称', 0)):
-                                qing_yan_jie_bei_info['产品名称'] = f"{get_initials(ming_cheng[:2])}({get_initials(ming_cheng[2:4])})"
-                                qing_yan_jie_bei_info['净值日期'] = jing_zhi_ri_qi
-                                qing_yan_jie_bei_info['持有份额'] = fen_e
-                                qing_yan_jie_bei_info['单位净值'] = dan_wei_jing_zhi
-                                qing_yan_jie_bei_info['虚拟净值'] = xu_ni_jing_zhi
-                                qing_yan_jie_bei_info['计提前金额'] = ji_ti_qian_jin_e
-                                qing_yan_jie_bei_info['计提后金额'] = ji_ti_hou_jin_e
-                                qing_yan_jie_bei_info['当期业绩报酬'] = dang_qi_ye_ji_bao_chou
-                        #kai du
-                        if re.search(b'\xe8\x99\x9a\xe6\x8b\x9f.*\xe5\x87\xaf\xe8\xaf\xbb'.decode('utf-8'), body, re.DOTALL):
-                            td_contents = re.findall(r'<td>(.*?)</td>', body, flags=re.DOTALL)
-                            # print(td_contents)
-                            ming_cheng = td_contents[1]
-                            jing_zhi_ri_qi = datetime.strptime(td_contents[2], "%Y%m%d").strftime("%Y-%m-%d")
-                            fen_e = float(td_contents[6].replace(',',''))
-                            dan_wei_jing_zhi = float(td_contents[7].replace(',',''))
-                            xu_ni_jing_zhi = float(td_contents[10].replace(',',''))
-                            ji_ti_qian_jin_e = float(td_contents[5].replace(',',''))
-                            ji_ti_hou_jin_e = ji_ti_qian_jin_e - float(td_contents[9].replace(',',''))
-                            dang_qi_ye_ji_bao_chou = float(td_contents[9].replace(',',''))
-                            if not (kai_du_info.get('产品名称', 0)):
-                                kai_du_info['产品名称'] = get_initials(ming_cheng[:2])
-                                kai_du_info['净值日期'] = jing_zhi_ri_qi
-                                kai_du_info['计提前金额'] = ji_ti_qian_jin_e
-                                kai_du_info['计提后金额'] = ji_ti_hou_jin_e
-                                kai_du_info['当期业绩报酬'] = dang_qi_ye_ji_bao_chou
-                                kai_du_info['持有份额'] = fen_e
-                                kai_du_info['单位净值'] = dan_wei_jing_zhi
-                                kai_du_info['虚拟净值'] = xu_ni_jing_zhi
-                        # #wan yan 1
-                        # if re.search(b'\xe8\x99\x9a\xe6\x8b\x9f.*\xe9\xa1\xbd\xe5\xb2\xa9\xe4\xb8\xad\xe8\xaf\x812000\xe6\x8c\x87\xe6\x95\xb0\xe5\xa2\x9e\xe5\xbc\xba1\xe5\x8f\xb7'.decode('utf-8'), body, re.DOTALL):
-                        #     td_contents = re.findall(r'<td>(.*?)</td>', body, flags=re.DOTALL)
-                        #     # print(td_contents)
-                        #     ming_cheng = td_contents[1]
-                        #     jing_zhi_ri_qi = datetime.strptime(td_contents[2], "%Y%m%d").strftime("%Y-%m-%d")
-                        #     fen_e = float(td_contents[6].replace(',',''))
-                        #     dan_wei_jing_zhi = float(td_contents[7].replace(',',''))
-                        #     xu_ni_jing_zhi = float(td_contents[10].replace(',',''))
-                        #     ji_ti_qian_jin_e = float(td_contents[5].replace(',',''))
-                        #     ji_ti_hou_jin_e = ji_ti_qian_jin_e - float(td_contents[9].replace(',',''))
-                        #     dang_qi_ye_ji_bao_chou = float(td_contents[9].replace(',',''))
-                        #     if not (wan_yan_1_info.get('产品名称', 0)):
-                        #         wan_yan_1_info['产品名称'] = get_initials(ming_cheng[:2] + "1")
-                        #         wan_yan_1_info['净值日期'] = jing_zhi_ri_qi
-                        #         wan_yan_1_info['计提前金额'] = ji_ti_qian_jin_e
-                        #         wan_yan_1_info['计提后金额'] = ji_ti_hou_jin_e
-                        #         wan_yan_1_info['当期业绩报酬'] = dang_qi_ye_ji_bao_chou
-                        #         wan_yan_1_info['持有份额'] = fen_e
-                        #         wan_yan_1_info['单位净值'] = dan_wei_jing_zhi
-                        #         wan_yan_1_info['虚拟净值'] = xu_ni_jing_zhi
-                        # #han rong
-                        # if re.search(b'\xe8\x99\x9a\xe6\x8b\x9f.*\xe7\xbf\xb0\xe8\x8d\xa3'.decode('utf-8'), body, re.DOTALL):
-                        #     td_contents = re.findall(r'<td>(.*?)</td>', body, flags=re.DOTALL)
-                        #     # print(td_contents)
-                        #     ming_cheng = td_contents[1]
-                        #     jing_zhi_ri_qi = datetime.strptime(td_contents[2], "%Y%m%d").strftime("%Y-%m-%d")
-                        #     fen_e = float(td_contents[6].replace(',',''))
-                        #     dan_wei_jing_zhi = float(td_contents[7].replace(',',''))
-                        #     xu_ni_jing_zhi = float(td_contents[10].replace(',',''))
-                        #     ji_ti_qian_jin_e = float(td_contents[5].replace(',',''))
-                        #     ji_ti_hou_jin_e = ji_ti_qian_jin_e - float(td_contents[9].replace(',',''))
-                        #     dang_qi_ye_ji_bao_chou = float(td_contents[9].replace(',',''))
-                        #     if not (han_rong_info.get('产品名称', 0)):
-                        #         han_rong_info['产品名称'] = get_initials(ming_cheng[:2])
-                        #         han_rong_info['净值日期'] = jing_zhi_ri_qi
-                        #         han_rong_info['计提前金额'] = ji_ti_qian_jin_e
-                        #         han_rong_info['计提后金额'] = ji_ti_hou_jin_e
-                        #         han_rong_info['当期业绩报酬'] = dang_qi_ye_ji_bao_chou
-                        #         han_rong_info['持有份额'] = fen_e
-                        #         han_rong_info['单位净值'] = dan_wei_jing_zhi
-                        #         han_rong_info['虚拟净值'] = xu_ni_jing_zhi
-                        # #wan yan 3
-                        # if re.search(b'\xe8\x99\x9a\xe6\x8b\x9f.*\xe9\xa1\xbd\xe5\xb2\xa9\xe4\xb8\xad\xe8\xaf\x812000\xe6\x8c\x87\xe6\x95\xb0\xe5\xa2\x9e\xe5\xbc\xba3\xe5\x8f\xb7'.decode('utf-8'), body, re.DOTALL):
-                        #     td_contents = re.findall(r'<td>(.*?)</td>', body, flags=re.DOTALL)
-                        #     # print(td_contents)
-                        #     ming_cheng = td_contents[1]
-                        #     jing_zhi_ri_qi = datetime.strptime(td_contents[2], "%Y%m%d").strftime("%Y-%m-%d")
-                        #     fen_e = float(td_contents[6].replace(',',''))
-                        #     dan_wei_jing_zhi = float(td_contents[7].replace(',',''))
-                        #     xu_ni_jing_zhi = float(td_contents[10].replace(',',''))
-                        #     ji_ti_qian_jin_e = float(td_contents[5].replace(',',''))
-                        #     ji_ti_hou_jin_e = ji_ti_qian_jin_e - float(td_contents[9].replace(',',''))
-                        #     dang_qi_ye_ji_bao_chou = float(td_contents[9].replace(',',''))
-                        #     if not (wan_yan_3_info.get('产品名称', 0)):
-                        #         wan_yan_3_info['产品名称'] = get_initials(ming_cheng[:2] + "3")
-                        #         wan_yan_3_info['净值日期'] = jing_zhi_ri_qi
-                        #         wan_yan_3_info['计提前金额'] = ji_ti_qian_jin_e
-                        #         wan_yan_3_info['计提后金额'] = ji_ti_hou_jin_e
-                        #         wan_yan_3_info['当期业绩报酬'] = dang_qi_ye_ji_bao_chou
-                        #         wan_yan_3_info['持有份额'] = fen_e
-                        #         wan_yan_3_info['单位净值'] = dan_wei_jing_zhi
-                        #         wan_yan_3_info['虚拟净值'] = xu_ni_jing_zhi
-                        # #liang chuang
-                        # if re.search(b'\xe8\x99\x9a\xe6\x8b\x9f.*\xe9\x87\x8f\xe5\x88\x9b'.decode('utf-8'), body, re.DOTALL):
-                        #     td_contents = re.findall(r'<td>(.*?)</td>', body, flags=re.DOTALL)
-                        #     # print(td_contents)
-                        #     ming_cheng = td_contents[2].split('：')[-1]
-                        #     jing_zhi_ri_qi = td_contents[4].split('：')[-1]
-                        #     fen_e = float(td_contents[7].split('：')[-1].replace(',',''))
-                        #     dan_wei_jing_zhi = float(td_contents[8].split('：')[-1].replace(',',''))
-                        #     xu_ni_jing_zhi = float(td_contents[10].split('：')[-1].replace(',',''))
-                        #     ji_ti_qian_jin_e = round(dan_wei_jing_zhi * fen_e, 2)
-                        #     ji_ti_hou_jin_e = round(xu_ni_jing_zhi * fen_e, 2)
-                        #     dang_qi_ye_ji_bao_chou = round(ji_ti_qian_jin_e - ji_ti_hou_jin_e, 2)
-                        #     if not (liang_chuang_info.get('产品名称', 0)):
-                        #         liang_chuang_info['产品名称'] = get_initials(ming_cheng[:2])
-                        #         liang_chuang_info['净值日期'] = jing_zhi_ri_qi
-                        #         liang_chuang_info['计提前金额'] = ji_ti_qian_jin_e
-                        #         liang_chuang_info['计提后金额'] = ji_ti_hou_jin_e
-                        #         liang_chuang_info['当期业绩报酬'] = dang_qi_ye_ji_bao_chou
-                        #         liang_chuang_info['持有份额'] = fen_e
-                        #         liang_chuang_info['单位净值'] = dan_wei_jing_zhi
-                        #         liang_chuang_info['虚拟净值'] = xu_ni_jing_zhi
-                        # #zheng ding
-                        # if re.search(b'\xe8\x99\x9a\xe6\x8b\x9f.*\xe6\xad\xa3\xe5\xae\x9a'.decode('utf-8'), body, re.DOTALL):
-                        #     td_contents = re.findall(r'<td>(.*?)</td>', body, flags=re.DOTALL)
-                        #     # print(td_contents)
-                        #     ming_cheng = td_contents[2].split('：')[-1]
-                        #     jing_zhi_ri_qi = td_contents[4].split('：')[-1]
-                        #     fen_e = float(td_contents[7].split('：')[-1].replace(',',''))
-                        #     dan_wei_jing_zhi = float(td_contents[8].split('：')[-1].replace(',',''))
-                        #     xu_ni_jing_zhi = float(td_contents[10].split('：')[-1].replace(',',''))
-                        #     ji_ti_qian_jin_e = round(dan_wei_jing_zhi * fen_e, 2)
-                        #     ji_ti_hou_jin_e = round(xu_ni_jing_zhi * fen_e, 2)
-                        #     dang_qi_ye_ji_bao_chou = round(ji_ti_qian_jin_e - ji_ti_hou_jin_e, 2)
-                        #     if not (zheng_ding_info.get('产品名称', 0)):
-                        #         zheng_ding_info['产品名称'] = get_initials(ming_cheng[:2])
-                        #         zheng_ding_info['净值日期'] = jing_zhi_ri_qi
-                        #         zheng_ding_info['计提前金额'] = ji_ti_qian_jin_e
-                        #         zheng_ding_info['计提后金额'] = ji_ti_hou_jin_e
-                        #         zheng_ding_info['当期业绩报酬'] = dang_qi_ye_ji_bao_chou
-                        #         zheng_ding_info['持有份额'] = fen_e
-                        #         zheng_ding_info['单位净值'] = dan_wei_jing_zhi
-                        #         zheng_ding_info['虚拟净值'] = xu_ni_jing_zhi
-                        # #hui jin
-                        # if re.search(b'\xe8\x99\x9a\xe6\x8b\x9f.*\xe6\xb1\x87\xe7\x91\xbe'.decode('utf-8'), body, re.DOTALL):
-                        #     td_contents = re.findall(r'<td>(.*?)</td>', body, flags=re.DOTALL)
-                        #     # print(td_contents)
-                        #     ming_cheng = td_contents[2].split('：')[-1]
-                        #     jing_zhi_ri_qi = td_contents[4].split('：')[-1]
-                        #     fen_e = float(td_contents[7].split('：')[-1].replace(',',''))
-                        #     dan_wei_jing_zhi = float(td_contents[8].split('：')[-1].replace(',',''))
-                        #     xu_ni_jing_zhi = float(td_contents[10].split('：')[-1].replace(',',''))
-                        #     ji_ti_qian_jin_e = round(dan_wei_jing_zhi * fen_e, 2)
-                        #     ji_ti_hou_jin_e = round(xu_ni_jing_zhi * fen_e, 2)
-                        #     dang_qi_ye_ji_bao_chou = round(ji_ti_qian_jin_e - ji_ti_hou_jin_e, 2)
-                        #     if not (hui_jin_info.get('产品名称', 0)):
-                        #         hui_jin_info['产品名称'] = get_initials(ming_cheng[:2])
-                        #         hui_jin_info['净值日期'] = jing_zhi_ri_qi
-                        #         hui_jin_info['计提前金额'] = ji_ti_qian_jin_e
-                        #         hui_jin_info['计提后金额'] = ji_ti_hou_jin_e
-                        #         hui_jin_info['当期业绩报酬'] = dang_qi_ye_ji_bao_chou
-                        #         hui_jin_info['持有份额'] = fen_e
-                        #         hui_jin_info['单位净值'] = dan_wei_jing_zhi
-                        #         hui_jin_info['虚拟净值'] = xu_ni_jing_zhi
-                        # #meng xi
-                        # if re.search(b'\xe8\x99\x9a\xe6\x8b\x9f.*\xe8\x92\x99\xe7\x8e\xba'.decode('utf-8'), body, re.DOTALL):
-                        #     td_contents = re.findall(r'yahei="">(.*?)</span>', body, flags=re.DOTALL)
-                        #     # print(td_contents)
-                        #     ming_cheng = td_contents[5]
-                        #     jing_zhi_ri_qi = td_contents[3]
-                        #     fen_e = float(td_contents[8].replace(',',''))
-                        #     dan_wei_jing_zhi = float(td_contents[9].replace(',',''))
-                        #     xu_ni_jing_zhi = round(float(td_contents[12])/fen_e, 4)
-                        #     ji_ti_qian_jin_e = float(td_contents[11])
-                        #     ji_ti_hou_jin_e = float(td_contents[12])
-                        #     dang_qi_ye_ji_bao_chou = ji_ti_qian_jin_e - ji_ti_hou_jin_e
-                        #     if not (meng_xi_info.get('产品名称', 0)):
-                        #         meng_xi_info['产品名称'] = get_initials(ming_cheng[:2])
-                        #         meng_xi_info['净值日期'] = jing_zhi_ri_qi
-                        #         meng_xi_info['计提前金额'] = ji_ti_qian_jin_e
-                        #         meng_xi_info['计提后金额'] = ji_ti_hou_jin_e
-                        #         meng_xi_info['当期业绩报酬'] = dang_qi_ye_ji_bao_chou
-                        #         meng_xi_info['持有份额'] = fen_e
-                        #         meng_xi_info['单位净值'] = dan_wei_jing_zhi
-                        #         meng_xi_info['虚拟净值'] = xu_ni_jing_zhi
-    df = pd.DataFrame([wei_guan_info_a, wei_guan_info_b, qing_yan_he_xin_info, qing_yan_jie_bei_info, kai_du_info])
-    df = df.sort_values(by="计提前金额", ascending=False).set_index("产品名称", drop=True)
-    ji_ti_qian_zong_jin_e = round(df['计提前金额'].sum(), 2)
-    ji_ti_hou_zong_jin_e = round(df['计提后金额'].sum(), 2)
-    dang_qi_zong_ye_ji_bao_chou = ji_ti_qian_zong_jin_e - ji_ti_hou_zong_jin_e
-    df = df.style.format({
-        '计提前金额': '{:,.2f}',
-        '计提后金额': '{:,.2f}',
-        '当期业绩报酬': '{:,.2f}',
-        '持有份额': '{:,.2f}',
-        '单位净值': '{:,.4f}',
-        '虚拟净值': '{:,.4f}'
-    })
-    return df, ji_ti_qian_zong_jin_e, ji_ti_hou_zong_jin_e, dang_qi_zong_ye_ji_bao_chou
 
 def show_hedging_calculator():
     # 打印对冲计算器
@@ -435,24 +114,110 @@ def show_hedging_calculator():
                 if isinstance(long_money, (int, float)) and long_money > 0:
                     beijing_tz = timezone(timedelta(hours=8))
                     compute_time_obj = datetime.now(beijing_tz).strftime("%Y-%m-%d %H:%M:%S")
-                    futures_fees_info_df, update_time = generate_table(long_money)
+                    futures_fees_info_df, update_time = core.generate_table(long_money, fetch_futures_fees_info())
 
                     if not futures_fees_info_df.empty:
                         st.write(f"点击计算时间：{compute_time_obj}")
                         st.write(f"期货数据刷新时间：{update_time}")
+                        snapshot_age = core.get_futures_snapshot_cache().age()
+                        if snapshot_age is not None:
+                            st.caption(f"行情快照拉取于 {core.format_data_age(time.time() - snapshot_age)}")
+                        show_feed_metrics()
                         st.write("")
-                        st.dataframe(futures_fees_info_df.set_index("合约代码", drop=True), use_container_width=True)
+                        with core.timed_stage("render.hedge_table"):
+                            st.dataframe(core.format_hedge_table(futures_fees_info_df).set_index("合约代码", drop=True), use_container_width=True)
+                        show_hedge_combination(long_money)
                     else:
                         st.write("无法获取期货数据，请检查网络连接或稍后重试。")
                 else:
                     st.write("多头持仓输入不合法，请重新输入！")
         st.session_state.compute_button_clicked = False  # 解锁button
 
+@st.fragment(run_every=core.MONITOR_INTERVAL)
+def render_hedge_monitor():
+    # 只重跑本片段：读取缓存中的最新快照，增量重算价格变化的合约
+    monitor = st.session_state.get("hedge_monitor")
+    if monitor is None:
+        return
+    start = time.perf_counter()
+    with core.timed_stage("monitor.compute"):
+        snapshot = core.get_futures_snapshot_cache().get()
+        if not snapshot.empty:
+            monitor.update(snapshot)
+    compute_ms = (time.perf_counter() - start) * 1000
+    changed = set(monitor.changed)
+
+    start = time.perf_counter()
+    with core.timed_stage("monitor.render"):
+        styled = monitor.table.style.format({
+            "最新价": "{:.1f}", "已对冲总金额": "{:,.0f}", "对冲偏离": "{:+,.0f}", "需调整（手）": "{:+d}",
+            "对冲账户所需保证金": "{:,.0f}", "保证金占用": "{:.1%}",
+        }).apply(lambda row: ["background-color: #fff3cd" if row.name in changed else ""] * len(row), axis=1)
+        st.dataframe(styled, use_container_width=True)
+    render_ms = (time.perf_counter() - start) * 1000
+    monitor.record(compute_ms, render_ms)
+
+    summary = monitor.timing_summary()
+    snapshot_age = core.get_futures_snapshot_cache().age()
+    st.caption(f"每 {core.MONITOR_INTERVAL:g} 秒刷新，本次重算 {len(changed)} 个合约（高亮），"
+               f"计算 {compute_ms:.1f} ms、渲染 {render_ms:.1f} ms；"
+               f"近 {len(monitor.timings)} 次中位数/p95：计算 {summary['计算'][0]:.1f}/{summary['计算'][1]:.1f} ms，"
+               f"渲染 {summary['渲染'][0]:.1f}/{summary['渲染'][1]:.1f} ms"
+               + (f"；行情快照拉取于 {snapshot_age:.0f} 秒前" if snapshot_age is not None else ""))
+
+
+def show_hedge_monitor():
+    # 打印实时对冲监控
+    st.subheader("实时对冲监控")
+    long_money = st.text_input("监控的多头持仓（万元）：", "", key="monitor_long_money")
+    if not st.toggle("开启实时监控", key="monitor_enabled"):
+        st.session_state.pop("hedge_monitor", None)
+        return
+    try:
+        long_money = float(long_money.replace(",", "")) * 10000
+    except ValueError:
+        long_money = 0
+    if long_money <= 0:
+        st.write("多头持仓输入不合法，请重新输入！")
+        return
+    monitor = st.session_state.get("hedge_monitor")
+    if monitor is None or monitor.long_money != long_money:
+        snapshot = fetch_futures_fees_info()
+        if snapshot.empty:
+            return
+        st.session_state["hedge_monitor"] = core.HedgeMonitor(long_money, core.get_contract_snapshot(snapshot))
+    render_hedge_monitor()
+
+
+def show_trace_panel():
+    # 管理面板（页面地址加 ?admin=1 时显示）：最近各调用链的阶段耗时 p50/p95 与计数器
+    if st.query_params.get("admin") != "1":
+        return
+    trace_log = core.get_trace_log()
+    with st.expander(f"性能追踪（最近 {trace_log.traces.maxlen} 条调用链）"):
+        summary = trace_log.stage_summary()
+        if summary.empty:
+            st.write("暂无追踪数据。")
+            return
+        roots = summary.index.get_level_values("root").unique()
+        root = st.selectbox("调用链：", roots, key="trace_root")
+        st.dataframe(summary.loc[root].sort_values("p95(ms)", ascending=False).style.format(
+            {"平均次数": "{:.1f}", "p50(ms)": "{:,.1f}", "p95(ms)": "{:,.1f}"}), use_container_width=True)
+        counters = trace_log.counter_summary()
+        if not counters.empty and root in counters.index.get_level_values("root"):
+            st.table(counters.loc[root])
+        if core.TRACE_LOG_PATH:
+            st.caption(f"JSON 行日志：{core.TRACE_LOG_PATH}")
+
+
 def main():
     # 打印持仓信息
     st.write("")
     st.write("")
     st.subheader("实时持仓查询")
+    account_names = [account["name"] for account in core.PORTFOLIO_CONFIG["accounts"]]
+    # 多账户时在查询前选择账户（密码验证流程会触发重跑，选择框放在流程之外）
+    account_name = st.selectbox("账户：", account_names, key="account_name") if len(account_names) > 1 else account_names[0]
     if "refresh_button_clicked" not in st.session_state:
         st.session_state.refresh_button_clicked = False
     if "pwd_success" not in st.session_state or not st.session_state.refresh_button_clicked:
@@ -466,8 +231,7 @@ def main():
         st.session_state.refresh_button_clicked = True
         if secret_key:
             # 用户点击确认提交后验证
-            pwd_hash_bytes = "cc0c2d8a98edc8c08b40b7ea6a8828f2686e33aa81b64230b4f75e0f10d4e98599cab16700230dee97151ff23f6925478c456999684eadd7f21e8d97fc495801"
-            if hash_string(secret_key) == pwd_hash_bytes:
+            if core.verify_secret_key(secret_key):
                 st.session_state["pwd_success"] = True
                 st.session_state["secret_key"] = secret_key
                 if (st.session_state.refresh_button_clicked):
@@ -478,6 +242,7 @@ def main():
                 st.write("")
                 st.write("")
                 show_hedging_calculator()
+                show_hedge_monitor()
                 return
         else:
             st.session_state.refresh_button_clicked = False
@@ -485,28 +250,49 @@ def main():
             st.write("")
             st.write("")
             show_hedging_calculator()
+            show_hedge_monitor()
             return
     if (st.session_state["pwd_success"]):
         st.session_state["pwd_success"] = False
         st.session_state.refresh_button_clicked = False
         st.success("密码验证成功！")
         with st.spinner("刷新持仓数据中，请稍候..."):
-            # 获取时间和Email信息
-            beijing_tz = timezone(timedelta(hours=8))
-            extract_email_time = datetime.now(beijing_tz).strftime("%Y-%m-%d %H:%M:%S")
-            email_df, ji_ti_qian_zong_jin_e, ji_ti_hou_zong_jin_e, dang_qi_zong_ye_ji_bao_chou \
-                = extract_email(st.session_state["secret_key"])
-            cheng_ben_zong_jin_e = 11838238.41
+            # 读取后台预热的持仓数据（尚无数据时当场同步）
+            nav_result, extract_email_ts = core.get_nav_result(st.session_state["secret_key"])
+            nav_df, sync_stats = nav_result
+            details, account_totals = core.account_holdings(nav_df, account_name)
+            email_df = core.format_holdings(details)
+            cheng_ben_zong_jin_e = account_totals["成本总金额"]
+            ji_ti_qian_zong_jin_e = account_totals["计提前总金额"]
+            ji_ti_hou_zong_jin_e = account_totals["计提后总金额"]
+            dang_qi_zong_ye_ji_bao_chou = account_totals["当期总业绩报酬"]
+            qi_shi_ri_qi = datetime.strptime(account_totals["起始日期"], "%Y-%m-%d")
             # 打印持仓信息
-            st.write(f"持仓数据刷新时间：{extract_email_time}")
+            st.write(f"持仓数据刷新时间：{core.format_data_age(extract_email_ts)}")
+            if sync_stats["新邮件数"]:
+                saved_bytes = sync_stats["邮件总字节数"] - sync_stats["下载字节数"]
+                st.caption(f"本次同步 {sync_stats['新邮件数']} 封新邮件，下载 {sync_stats['下载字节数'] / 1024:,.1f} KB，"
+                           f"跳过附件与纯文本节省 {saved_bytes / 1024:,.1f} KB")
+            if sync_stats.get("解析失败邮件"):
+                st.warning("以下净值邮件格式异常，已跳过：" +
+                           "；".join(f"UID {uid}（{error}）" for uid, error in sync_stats["解析失败邮件"]))
+            missing = core.missing_nav_products(details)
+            if missing:
+                st.warning(f"以下产品在净值库中还没有净值邮件，未计入汇总金额：{'、'.join(missing)}")
             st.write(f"成本总金额：{cheng_ben_zong_jin_e:,.2f}")
             st.write(f"计提前总金额：{ji_ti_qian_zong_jin_e:,.2f}")
             st.write(f"计提后总金额：{ji_ti_hou_zong_jin_e:,.2f}")
             st.write(f"当期总业绩报酬：{dang_qi_zong_ye_ji_bao_chou:,.2f}")
-            st.write(f"当期总盈亏(2024年11月8日~至今)：{(ji_ti_hou_zong_jin_e - cheng_ben_zong_jin_e):+,.2f} \({(ji_ti_hou_zong_jin_e - cheng_ben_zong_jin_e)/cheng_ben_zong_jin_e:+.2%}\)")
+            st.write(f"当期总盈亏({qi_shi_ri_qi.year}年{qi_shi_ri_qi.month}月{qi_shi_ri_qi.day}日~至今)：{(ji_ti_hou_zong_jin_e - cheng_ben_zong_jin_e):+,.2f} \({(ji_ti_hou_zong_jin_e - cheng_ben_zong_jin_e)/cheng_ben_zong_jin_e:+.2%}\)")
             # 显示持仓信息表格
             st.write("")
-            st.table(email_df)
+            with core.timed_stage("render.holdings"):
+                st.table(email_df)
+                show_nav_history()
+        # 与持仓表格一样只在本次验证通过后显示，下一次重跑（pwd_input 已清空）即隐藏
+        st.write("")
+        st.write("")
+        show_holdings_hedge(account_name)
     st.write("")
     st.write("")
     st.write("")
@@ -514,7 +300,12 @@ def main():
     st.write("")
     st.write("")
     show_hedging_calculator()
+    show_hedge_monitor()
+    show_trace_panel()
 
 
 if __name__ == '__main__':
-    main()
+    core.get_trace_log()  # 先注册追踪监听器，后台预热的阶段也被记录
+    core.get_scheduler()  # 启动后台调度线程；行情快照在首次用到时才注册定时刷新
+    with core.timed_stage("page.run"):
+        main()
@@ -0,0 +1,301 @@
+"""离线邮件回放：不依赖真实邮箱即可运行净值邮件的同步与解析流程。
+
+    FakeImapServer       内存中的 IMAP 服务器替身，实现 hedging_core 用到的 imaplib 接口子集（含 BODYSTRUCTURE 与分段 FETCH）
+    make_nav_mail        按 NAV_PARSERS 中各管理人的格式生成合成净值邮件
+    load_messages        读取 .eml 目录或 Maildir
+
+生成合成邮件目录（可用于 NAV_MAIL_REPLAY_DIR 或 benchmark.py）：
+
+    python mail_replay.py OUT_DIR --days 30
+"""
+import argparse
+import email
+import mailbox
+import pathlib
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.header import decode_header, make_header
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import format_datetime, parsedate_to_datetime
+
+import numpy as np
+
+import hedging_core as core
+
+BEIJING_TZ = timezone(timedelta(hours=8))
+# 各单元格正则对应的 HTML 片段
+CELL_TEMPLATES = {
+    core.TD_CELL: "<td>{}</td>",
+    r"padding:5px;'>(.*?)</td>": "<td style='padding:5px;'>{}</td>",
+    r'left:10px">(.*?)</td>': '<td style="padding-left:10px">{}</td>',
+    r'yahei="">(.*?)</span>': '<span microsoft-yahei="">{}</span>',
+}
+
+
+def make_nav_mail(product_key, mail_time, fen_e=1000000.0, dan_wei_jing_zhi=1.2345, xu_ni_jing_zhi=1.2100,
+                  attachment_bytes=0):
+    """按 NAV_PARSERS[product_key] 的格式生成一封净值邮件（原文 bytes），attachment_bytes > 0 时附带 PDF 附件"""
+    spec = core.NAV_PARSERS[product_key]
+    ming_cheng = spec.get("product_name") or "".join(spec["keywords"][1:]) + "私募证券投资基金"
+    ji_ti_qian_jin_e = round(fen_e * dan_wei_jing_zhi, 2)
+    ji_ti_hou_jin_e = round(fen_e * xu_ni_jing_zhi, 2)
+    values = {
+        "名称": ming_cheng,
+        "净值日期": mail_time.strftime(spec.get("date_format") or "%Y-%m-%d"),
+        "持有份额": f"{fen_e:,.2f}",
+        "单位净值": f"{dan_wei_jing_zhi:.4f}",
+        "虚拟净值": f"{xu_ni_jing_zhi:.4f}",
+        "计提前金额": f"{ji_ti_qian_jin_e:,.2f}",
+        "计提后金额": f"{ji_ti_hou_jin_e:,.2f}",
+        "当期业绩报酬": f"{ji_ti_qian_jin_e - ji_ti_hou_jin_e:,.2f}",
+    }
+    cells = ["-"] * (max(spec["fields"].values()) + 1)
+    for field, index in spec["fields"].items():
+        cells[index] = f"{field}{spec['value_separator']}{values[field]}" if spec.get("value_separator") else values[field]
+    template = CELL_TEMPLATES[spec["cell_pattern"]]
+    html = (f"<html><body><p>尊敬的投资者：以下为虚拟净值计算结果</p><p>{ming_cheng}</p>"
+            f"<table><tr>{''.join(template.format(cell) for cell in cells)}</tr></table></body></html>")
+
+    message = MIMEMultipart("mixed" if attachment_bytes else "alternative")
+    message["Subject"] = f"{ming_cheng}虚拟净值通知"
+    message["From"] = "nav@example.com"
+    message["To"] = "investor@example.com"
+    message["Date"] = format_datetime(mail_time)
+    message.attach(MIMEText(f"{ming_cheng} 虚拟净值 {values['虚拟净值']}", "plain", "utf-8"))
+    message.attach(MIMEText(html, "html", "utf-8"))
+    if attachment_bytes:
+        statement = MIMEApplication(bytes(attachment_bytes), _subtype="pdf")
+        statement.add_header("Content-Disposition", "attachment", filename="statement.pdf")
+        message.attach(statement)
+    return message.as_bytes()
+
+
+def generate_corpus(days=16, product_keys=core.NAV_PRODUCT_KEYS, mails_per_day=1, end=None, attachment_bytes=0, seed=0):
+    """生成 days 天内每个产品每天 mails_per_day 封的合成净值邮件，按时间升序"""
+    rng = np.random.default_rng(seed)
+    end = datetime.now(BEIJING_TZ).replace(hour=18, minute=0, second=0, microsecond=0) if end is None else end
+    messages = []
+    for day in range(days, 0, -1):
+        for i in range(mails_per_day):
+            for key in product_keys:
+                dan_wei_jing_zhi = round(rng.uniform(0.9, 1.5), 4)
+                mail_time = end - timedelta(days=day - 1, minutes=i)
+                messages.append((mail_time, make_nav_mail(key, mail_time, fen_e=round(rng.uniform(1e5, 5e6), 2),
+                                                          dan_wei_jing_zhi=dan_wei_jing_zhi,
+                                                          xu_ni_jing_zhi=round(dan_wei_jing_zhi * rng.uniform(0.97, 1.0), 4),
+                                                          attachment_bytes=attachment_bytes)))
+    return [raw for _mail_time, raw in sorted(messages, key=lambda item: item[0])]
+
+
+def load_messages(path):
+    """读取 Maildir（含 cur/new 子目录）或目录下所有 .eml 文件的邮件原文"""
+    path = pathlib.Path(path)
+    if (path / "cur").is_dir():
+        return [message.as_bytes() for message in mailbox.Maildir(path, factory=None, create=False)]
+    return [eml.read_bytes() for eml in sorted(path.rglob("*.eml"))]
+
+
+def parse_message_set(message_set, max_uid):
+    """解析 IMAP 消息集（如 b"1,3,5:7"、"12:*"），返回 UID 集合"""
+    message_set = message_set.decode() if isinstance(message_set, bytes) else str(message_set)
+    uids = set()
+    for item in message_set.split(","):
+        if ":" in item:
+            low, high = (max_uid if bound == "*" else int(bound) for bound in item.split(":"))
+            uids.update(range(min(low, high), max(low, high) + 1))
+        else:
+            uids.add(max_uid if item == "*" else int(item))
+    return uids
+
+
+class FakeImapServer:
+    """IMAP 服务器替身：邮件按加入顺序分配 UID，connect() 返回独立会话，latency 模拟每条命令的往返时延（秒）"""
+
+    def __init__(self, messages=(), uidvalidity=1, latency=0.0):
+        self.uidvalidity = uidvalidity
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._messages = {}  # UID -> 邮件原文
+        self._headers = {}  # UID -> (收件时间, 主题)
+        self.bytes_sent = 0
+        self.commands = 0
+        for raw_email in messages:
+            self.append(raw_email)
+
+    @classmethod
+    def from_directory(cls, path, **kwargs):
+        return cls(load_messages(path), **kwargs)
+
+    def append(self, raw_email):
+        header = email.message_from_bytes(raw_email)
+        with self._lock:
+            uid = len(self._messages) + 1
+            self._messages[uid] = raw_email
+            self._headers[uid] = (parsedate_to_datetime(header["Date"]), str(make_header(decode_header(header["Subject"] or ""))))
+        return uid
+
+    def connect(self):
+        return FakeImapSession(self)
+
+    def _record(self, payload_bytes=0):
+        with self._lock:
+            self.commands += 1
+            self.bytes_sent += payload_bytes
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeImapSession:
+    """单个 IMAP 会话，实现 status / select / uid('search' | 'fetch') / logout"""
+
+    def __init__(self, server):
+        self.server = server
+        server._record()  # 登录
+
+    def select(self, mailbox='INBOX'):
+        self.server._record()
+        return 'OK', [str(len(self.server._messages)).encode()]
+
+    def status(self, mailbox, names):
+        self.server._record()
+        return 'OK', [f'{mailbox} (UIDVALIDITY {self.server.uidvalidity} UIDNEXT {len(self.server._messages) + 1})'.encode()]
+
+    def logout(self):
+        return 'BYE', [b'']
+
+    def uid(self, command, *args):
+        if command.lower() == 'search':
+            return self._search(args[1:])
+        if command.lower() == 'fetch':
+            return self._fetch(*args)
+        raise NotImplementedError(command)
+
+    def _search(self, criteria):
+        uids = set(self.server._messages)
+        criteria = [item.decode('utf-8') if isinstance(item, bytes) else item for item in criteria]
+        for i in range(0, len(criteria), 2):
+            key, value = criteria[i].upper(), criteria[i + 1]
+            if key == 'SINCE':
+                since = datetime.strptime(value, '%d-%b-%Y').date()
+                uids = {uid for uid in uids if self.server._headers[uid][0].astimezone(BEIJING_TZ).date() >= since}
+            elif key == 'SUBJECT':
+                uids = {uid for uid in uids if value in self.server._headers[uid][1]}
+            elif key == 'UID':
+                matched = parse_message_set(value, max(self.server._messages, default=0))
+                # 与真实服务器一致：“n:*” 至少返回最后一封邮件
+                uids = {uid for uid in uids if uid in matched or uid == max(self.server._messages)}
+            else:
+                raise NotImplementedError(key)
+        self.server._record()
+        return 'OK', [' '.join(map(str, sorted(uids))).encode()]
+
+    def _fetch(self, message_set, items):
+        """按 imaplib 的分段方式返回：字面量数据项为 (前缀, 数据) 元组，其余数据项以文本拼入前缀或结尾的 b')'"""
+        uids = sorted(parse_message_set(message_set, max(self.server._messages, default=0)) & set(self.server._messages))
+        response, payload_bytes = [], 0
+        for seq, uid in enumerate(uids, start=1):
+            text = f'{seq} (UID {uid}'
+            for name, data in self._fetch_items(uid, items):
+                payload_bytes += len(data)
+                if isinstance(data, bytes):
+                    response.append((f'{text} {name} {{{len(data)}}}'.encode(), data))
+                    text = ''
+                else:
+                    text += f' {name} {data}'
+            response.append(f'{text})'.encode())
+        self.server._record(payload_bytes)
+        return 'OK', response
+
+    def _fetch_items(self, uid, items):
+        """返回 [(数据项名, 值)]：值为 bytes 时以字面量下发，为 str 时直接写入响应行"""
+        raw_email = self.server._messages[uid]
+        message = email.message_from_bytes(raw_email)
+        results = []
+        for item in re.findall(r'BODY\.PEEK\[[^\]]*\]|[A-Z0-9.]+', items.strip('()').upper()):
+            if item == 'BODYSTRUCTURE':
+                results.append((item, body_structure(message)))
+            elif item == 'RFC822.SIZE':
+                results.append((item, str(len(raw_email))))
+            elif item.startswith('BODY.PEEK['):
+                section = item[len('BODY.PEEK['):-1]
+                if section == '':
+                    data = raw_email
+                elif section.startswith('HEADER.FIELDS'):
+                    names = re.search(r'\((.*)\)', section).group(1).split()
+                    data = (''.join(f'{name.capitalize()}: {message[name]}\r\n' for name in names if message[name] is not None)
+                            + '\r\n').encode()
+                else:
+                    data = message_part(message, section).get_payload(decode=False).encode('ascii', errors='replace')
+                results.append((f'BODY[{section}]', data))
+            else:
+                raise NotImplementedError(item)
+        return results
+
+
+def imap_string(value):
+    """IMAP 带引号字符串，None 为 NIL"""
+    return 'NIL' if value is None else '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def body_structure(part):
+    """按 RFC 3501 生成 BODYSTRUCTURE（含扩展数据中的 Content-Disposition）"""
+    if part.get_content_type() == 'message/rfc822':
+        # 转发的整封邮件：基本字段 + 信封（此处从略为 NIL）+ 内层邮件的 BODYSTRUCTURE + 行数
+        inner = part.get_payload(0)
+        raw = inner.as_bytes()
+        lines = raw.count(b"\n")
+        return f'("MESSAGE" "RFC822" NIL NIL NIL "7BIT" {len(raw)} NIL {body_structure(inner)} {lines})'
+    if part.is_multipart():
+        children = ''.join(body_structure(child) for child in part.get_payload())
+        return f'({children} {imap_string(part.get_content_subtype().upper())})'
+    params = part.get_params()[1:] if part.get_params() else []
+    params = f"({' '.join(f'{imap_string(key.upper())} {imap_string(value)}' for key, value in params)})" if params else 'NIL'
+    payload = part.get_payload(decode=False)
+    structure = [imap_string(part.get_content_maintype().upper()), imap_string(part.get_content_subtype().upper()), params,
+                 imap_string(part['Content-ID']), imap_string(part['Content-Description']),
+                 imap_string((part['Content-Transfer-Encoding'] or '7BIT').upper()), str(len(payload))]
+    if part.get_content_maintype() == 'text':
+        structure.append(str(payload.count('\n')))
+    disposition = part.get_content_disposition()
+    if disposition is None:
+        structure += ['NIL', 'NIL']
+    else:
+        filename = part.get_param('filename', header='Content-Disposition')
+        disposition_params = f'("FILENAME" {imap_string(filename)})' if filename else 'NIL'
+        structure += ['NIL', f'({imap_string(disposition.upper())} {disposition_params})']
+    return f"({' '.join(structure)})"
+
+
+def message_part(message, section):
+    """按 IMAP 段号（如 "1.2"）取 MIME 部分，单部分邮件的正文为段 1"""
+    part = message
+    for index in section.split('.'):
+        if part.is_multipart():
+            part = part.get_payload()[int(index) - 1]
+        elif index != '1':
+            raise KeyError(section)
+    return part
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir", help="输出目录，每封邮件一个 .eml 文件")
+    parser.add_argument("--days", type=int, default=16)
+    parser.add_argument("--mails-per-day", type=int, default=1)
+    parser.add_argument("--attachment-bytes", type=int, default=0)
+    args = parser.parse_args()
+
+    out_dir = pathlib.Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    messages = generate_corpus(args.days, mails_per_day=args.mails_per_day, attachment_bytes=args.attachment_bytes)
+    for i, raw_email in enumerate(messages):
+        (out_dir / f"{i:06d}.eml").write_bytes(raw_email)
+    print(f"已生成 {len(messages)} 封邮件：{out_dir}")
+
+
+if __name__ == '__main__':
+    main()
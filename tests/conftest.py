@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 仓库根目录下的模块（hedging_core、mail_replay 等）直接导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,87 @@
+"""熔断器状态机（虚拟时钟）与 ResilientFeed 的重试、超时"""
+import threading
+
+import pandas as pd
+
+import hedging_core as core
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_breaker_opens_after_threshold_and_recovers():
+    clock = VirtualClock()
+    breaker = core.CircuitBreaker(failure_threshold=3, reset_timeout=10.0, clock=clock)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == core.CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == core.CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    clock.sleep(10.0)
+    assert breaker.state == core.CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()  # 半开时只放行一个试探请求
+    breaker.record_success()
+    assert breaker.state == core.CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_reopens_when_probe_fails():
+    clock = VirtualClock()
+    breaker = core.CircuitBreaker(failure_threshold=1, reset_timeout=5.0, clock=clock)
+    breaker.record_failure()
+    clock.sleep(5.0)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == core.CircuitBreaker.OPEN
+    clock.sleep(4.9)
+    assert not breaker.allow()
+
+
+def test_feed_retries_then_succeeds():
+    clock = VirtualClock()
+    results = [ConnectionError("down"), ConnectionError("down"), pd.DataFrame({"a": [1]})]
+
+    def fetch():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    feed = core.ResilientFeed(fetch, policy=core.RetryPolicy(max_attempts=3, timeout=None), sleep=clock.sleep)
+    assert len(feed()) == 1
+    assert feed.metrics.counters["失败次数"] == 2
+    assert 0 < clock.now <= 0.5 + 1.0  # 两次退避
+
+
+def test_hung_requests_do_not_starve_later_attempts():
+    release = threading.Event()
+    hang = [True]
+
+    def fetch():
+        if hang[0]:
+            release.wait()
+        return pd.DataFrame({"a": [1]})
+
+    clock = VirtualClock()
+    breaker = core.CircuitBreaker(failure_threshold=100, clock=clock)
+    feed = core.ResilientFeed(fetch, policy=core.RetryPolicy(max_attempts=1, timeout=0.02), breaker=breaker)
+    try:
+        for _ in range(6):  # 多于旧实现的线程池大小（4）
+            assert feed().empty
+        hang[0] = False
+        assert len(feed()) == 1
+        assert feed.metrics.counters["超时次数"] == 6
+    finally:
+        release.set()
@@ -0,0 +1,120 @@
+"""IMAP 响应解析、BODYSTRUCTURE 分派与本地净值库增量同步（使用 mail_replay.FakeImapServer）"""
+import email
+from datetime import datetime, timedelta, timezone
+from email.mime.application import MIMEApplication
+from email.mime.message import MIMEMessage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import format_datetime
+
+import pytest
+
+import hedging_core as core
+import mail_replay
+
+NOW = datetime.now(timezone(timedelta(hours=8))).replace(hour=18, minute=0, second=0, microsecond=0)
+PRODUCT = core.NAV_PRODUCT_KEYS[0]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return core.NavStore(str(tmp_path / "nav_store.sqlite3"))
+
+
+def fetch_structure(raw_email):
+    server = mail_replay.FakeImapServer([raw_email])
+    _typ, data = server.connect().uid('fetch', b'1', '(BODYSTRUCTURE RFC822.SIZE)')
+    return core.parse_fetch_response(data)[b'1']
+
+
+def test_parse_fetch_response_tokens():
+    data = [(b'1 (UID 7 BODY[1] {5}', b'hello'),
+            b' FLAGS (\\Seen NIL) X-NAME "a \\"quoted\\" (str)")',
+            b'2 (UID 8 RFC822.SIZE 42)']
+    parsed = core.parse_fetch_response(data)
+    assert parsed[b'7']['BODY[1]'] == b'hello'
+    assert parsed[b'7']['FLAGS'] == [b'\\Seen', None]
+    assert parsed[b'7']['X-NAME'] == b'a "quoted" (str)'
+    assert parsed[b'8']['RFC822.SIZE'] == b'42'
+
+
+def test_find_html_sections_skips_text_and_attachments():
+    raw_email = mail_replay.make_nav_mail(PRODUCT, NOW, attachment_bytes=1000)
+    fields = fetch_structure(raw_email)
+    assert int(fields['RFC822.SIZE']) == len(raw_email)
+    assert core.find_html_sections(fields['BODYSTRUCTURE']) == [('2', 'base64')]
+
+
+def test_find_html_sections_rejects_forwarded_mail():
+    forwarded = MIMEMultipart("mixed")
+    forwarded["Date"] = format_datetime(NOW)
+    forwarded["Subject"] = "Fwd: 虚拟净值"
+    forwarded.attach(MIMEText("转发", "plain", "utf-8"))
+    forwarded.attach(MIMEMessage(email.message_from_bytes(mail_replay.make_nav_mail(PRODUCT, NOW))))
+    with pytest.raises(ValueError):
+        core.find_html_sections(fetch_structure(forwarded.as_bytes())['BODYSTRUCTURE'])
+
+
+def test_sync_is_incremental(store):
+    server = mail_replay.FakeImapServer(mail_replay.generate_corpus(3, end=NOW))
+    stats = core.sync_nav_store(server.connect, store)
+    assert stats["新邮件数"] == 3 * len(core.NAV_PRODUCT_KEYS)
+    assert set(store.latest()) == set(core.NAV_PRODUCT_KEYS)
+    assert core.sync_nav_store(server.connect, store)["新邮件数"] == 0
+
+    server.append(mail_replay.make_nav_mail(PRODUCT, NOW + timedelta(minutes=5), fen_e=123.0))
+    assert core.sync_nav_store(server.connect, store)["新邮件数"] == 1
+    assert store.latest()[PRODUCT]["持有份额"] == 123.0
+
+
+def test_sync_skips_mail_without_html_body(store):
+    text_only = MIMEMultipart("mixed")
+    text_only["Date"] = format_datetime(NOW)
+    text_only["Subject"] = "虚拟净值通知"
+    text_only.attach(MIMEText("见附件", "plain", "utf-8"))
+    statement = MIMEApplication(bytes(100_000), _subtype="pdf")
+    statement.add_header("Content-Disposition", "attachment", filename="statement.pdf")
+    text_only.attach(statement)
+    server = mail_replay.FakeImapServer([text_only.as_bytes(), mail_replay.make_nav_mail(PRODUCT, NOW)])
+    stats = core.sync_nav_store(server.connect, store)
+    assert stats["新邮件数"] == 2
+    assert stats["下载字节数"] < 10_000
+    assert list(store.latest()) == [PRODUCT]
+
+
+def test_sync_skips_malformed_mail(store):
+    malformed = MIMEText("<table><tr><td>虚拟</td><td>微观</td><td>志</td></tr></table>", "html", "utf-8")
+    malformed["Date"] = format_datetime(NOW - timedelta(minutes=1))
+    malformed["Subject"] = "虚拟净值通知"
+    server = mail_replay.FakeImapServer([malformed.as_bytes(), mail_replay.make_nav_mail("kai_du_info", NOW, fen_e=777.0)])
+    stats = core.sync_nav_store(server.connect, store)
+    assert [uid for uid, _error in stats["解析失败邮件"]] == ['1']
+    assert store.sync_state() == (1, 2)
+    assert store.latest()["kai_du_info"]["持有份额"] == 777.0
+
+
+def test_uidvalidity_change_resyncs(store):
+    old_server = mail_replay.FakeImapServer([mail_replay.make_nav_mail(PRODUCT, NOW, fen_e=1.0)], uidvalidity=1)
+    core.sync_nav_store(old_server.connect, store)
+    assert store.sync_state() == (1, 1)
+
+    new_server = mail_replay.FakeImapServer([mail_replay.make_nav_mail(PRODUCT, NOW, fen_e=2.0)], uidvalidity=2)
+    assert core.sync_nav_store(new_server.connect, store)["新邮件数"] == 1
+    assert store.sync_state() == (2, 1)
+    assert store.history()["持有份额"].tolist() == [2.0]
+
+
+def test_failed_login_is_not_retried_per_mail(store):
+    server = mail_replay.FakeImapServer(mail_replay.generate_corpus(4, end=NOW), latency=0.005)
+    attempts = []
+
+    def connect():
+        attempts.append(1)
+        if len(attempts) > 1:
+            raise ConnectionRefusedError("login refused")
+        return server.connect()
+
+    with pytest.raises(ConnectionRefusedError):
+        core.sync_nav_store(connect, store)
+    assert len(attempts) == 2
+    assert store.sync_state() is None
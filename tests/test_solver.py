@@ -0,0 +1,72 @@
+"""solve_hedge_lots 与穷举结果对照"""
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import hedging_core as core
+
+
+def make_contracts(rng, n_contracts=3):
+    lot_value = rng.integers(20, 60, n_contracts) * 40  # 与真实行情一样都是 0.2 × 200 = 40 元的整数倍
+    return pd.DataFrame({
+        "合约代码": [f"C{i}" for i in range(n_contracts)],
+        "合约名称": [f"合约{i}" for i in range(n_contracts)],
+        "1手市值": lot_value,
+        "做多保证金率（按金额）": rng.choice([0.12, 0.14, 0.16], n_contracts),
+    })
+
+
+def brute_force_key(long_money, contracts, objective, target_residual):
+    lot_value = contracts["1手市值"].to_numpy()
+    lot_margin = np.floor(lot_value * contracts["做多保证金率（按金额）"].to_numpy())
+    best = None
+    for lots in itertools.product(*[range(int(long_money // value) + 1) for value in lot_value]):
+        lots = np.array(lots)
+        hedged = lots @ lot_value
+        if hedged > long_money:
+            continue
+        key = solution_key(long_money - hedged, lots @ lot_margin, objective, target_residual)
+        best = key if best is None or key < best else best
+    return best
+
+
+def solution_key(residual, margin, objective, target_residual):
+    if objective == "residual":
+        return residual, margin
+    return max(residual - target_residual, 0), margin, residual
+
+
+@pytest.mark.parametrize("objective", ["residual", "margin"])
+def test_exact_mode_matches_brute_force(objective):
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        contracts = make_contracts(rng)
+        long_money = float(rng.integers(5000, 20000))
+        target_residual = float(rng.integers(0, 3000))
+        _lots, summary = core.solve_hedge_lots(long_money, contracts, objective=objective, target_residual=target_residual)
+        key = solution_key(long_money - summary["已对冲总金额"], summary["对冲账户所需保证金"], objective, target_residual)
+        assert key == brute_force_key(long_money, contracts, objective, target_residual)
+
+
+def test_heuristic_mode_is_consistent():
+    rng = np.random.default_rng(1)
+    contracts = make_contracts(rng, 4)
+    long_money = 1e7
+    lots_df, summary = core.solve_hedge_lots(long_money, contracts, resolution=1000)  # 精度不整除 1手市值，走近似离散化
+    hedged = int(lots_df["需做空（手）"] @ contracts["1手市值"])
+    assert summary["已对冲总金额"] == hedged <= long_money
+    assert summary["已对冲总金额"] + summary["未对冲总金额"] == long_money
+    # 不劣于逐合约整手对冲
+    assert summary["未对冲总金额"] <= (long_money % contracts["1手市值"]).min()
+
+
+def test_beta_basis_totals_add_up():
+    contracts = make_contracts(np.random.default_rng(2))
+    long_money = 12345.0
+    beta = {"C0": 1.13}
+    lots_df, summary = core.solve_hedge_lots(long_money, contracts, beta=beta)
+    effective_value = contracts["1手市值"] * contracts["合约代码"].map(beta).fillna(1.0)
+    assert summary["已对冲总金额"] == int(np.floor(lots_df["需做空（手）"] @ effective_value))
+    assert summary["已对冲总金额"] + summary["未对冲总金额"] in (long_money, long_money - 1)